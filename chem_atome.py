@@ -4,18 +4,26 @@ class Atome:
     """
     Classe représentant un atome.
 
+    Les atomes d'une molécule sont stockés dans les tableaux de Molecule ; un Atome n'en est qu'une
+    poignée légère (__slots__), créée à la demande et identifiée par son indice dans ces tableaux.
+
     Attributs:
-        dessin_atome (DessinAtome): L'objet DessinAtome associé à l'atome.
+        type (TYPE_ATOME): Le type de l'atome.
+        index (int): L'indice de l'atome dans sa molécule, None s'il n'appartient à aucune.
     """
 
-    def __init__(self, type_atome: TYPE_ATOME):
+    __slots__ = ('type', 'index')
+
+    def __init__(self, type_atome: TYPE_ATOME, index=None):
         """
         Initialise un objet Atome.
 
         Args:
-            type_atome (str): Le type d'atome ('carbon' ou 'hydrogen').
+            type_atome (TYPE_ATOME): Le type d'atome.
+            index (int): L'indice de l'atome dans sa molécule.
         """
         self.type = type_atome
+        self.index = index
 
     def get_valence(self):
         """
@@ -24,4 +32,4 @@ class Atome:
         Returns:
             int: La valence de l'atome.
         """
-        return params[self.type.value]['valence']
+        return int(VALENCES[TYPE_CODES[self.type]])
@@ -0,0 +1,165 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# number of decompositions, and their total size in bytes, kept in memory by default
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_MAX_BYTES = 256 * 2**20
+
+
+def matrix_key(matrix):
+    """
+    Returns:
+        str: The content hash of a matrix: its shape and its float64 bytes.
+    """
+    matrix = np.ascontiguousarray(matrix, dtype=np.float64)
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(np.array(matrix.shape, dtype=np.int64).tobytes())
+    digest.update(matrix.tobytes())
+    return digest.hexdigest()
+
+
+class EigenCache:
+    """
+    Content-addressed cache of eigen-decompositions of symmetric matrices.
+
+    Decompositions are keyed by the hash of the matrix content (matrix_key), so that the same matrix
+    is only diagonalized once whichever wavefunction, molecule edit or run it comes from. The memory
+    tier keeps the most recently used decompositions, at most max_entries of them and max_bytes in
+    total (the last one is always kept); with a directory, every
+    decomposition is also written there as <key>.npz and read back on a memory miss, which carries the
+    cache over between runs.
+
+    The cached arrays are read-only, since they are shared by all the callers.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES, directory=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def set_directory(self, directory):
+        """
+        Sets the directory of the on-disk tier, created if needed, or disables it with None.
+        """
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def get(self, key):
+        """
+        Returns:
+            tuple: The cached eigenvalues and eigenfunctions, or None.
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+        if self.directory is not None and os.path.exists(self._path(key)):
+            try:
+                with np.load(self._path(key)) as data:
+                    value = (data['eigenvalues'], data['eigenfunctions'])
+            except (OSError, ValueError, KeyError) as error:
+                logger.warning("Ignoring the unreadable cache entry %s: %s", self._path(key), error)
+            else:
+                value = self._remember(key, value)
+                with self._lock:
+                    self.disk_hits += 1
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, eigenvalues, eigenfunctions):
+        """
+        Stores a decomposition in the memory tier and, with a directory, on disk.
+
+        Returns:
+            tuple: The read-only cached eigenvalues and eigenfunctions.
+        """
+        value = self._remember(key, (eigenvalues, eigenfunctions))
+        if self.directory is not None and not os.path.exists(self._path(key)):
+            # written under a temporary name then renamed, so that concurrent runs never read a partial file
+            fd, temporary = tempfile.mkstemp(suffix='.npz', dir=self.directory)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    np.savez(f, eigenvalues=value[0], eigenfunctions=value[1])
+                os.replace(temporary, self._path(key))
+            except OSError as error:
+                logger.warning("Could not write the cache entry %s: %s", self._path(key), error)
+                if os.path.exists(temporary):
+                    os.remove(temporary)
+        return value
+
+    def _remember(self, key, value):
+        value = tuple(np.array(array) for array in value)
+        for array in value:
+            array.flags.writeable = False
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= sum(array.nbytes for array in previous)
+            self._entries[key] = value
+            self._bytes += sum(array.nbytes for array in value)
+            while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= sum(array.nbytes for array in evicted)
+                self.evictions += 1
+        return value
+
+    def eigh(self, matrix):
+        """
+        Cached numpy.linalg.eigh.
+
+        Returns:
+            tuple: The read-only eigenvalues, in ascending order, and eigenfunctions of the matrix.
+        """
+        key = matrix_key(matrix)
+        value = self.get(key)
+        if value is None:
+            value = self.put(key, *np.linalg.eigh(matrix))
+        return value
+
+    def clear(self):
+        """
+        Empties the memory tier; the files of the on-disk tier are kept.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_statistics(self):
+        """
+        Returns:
+            dict: The numbers of memory hits, disk hits, misses and evictions, and the number and size
+            in bytes of the decompositions held in memory.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'entries': len(self._entries), 'bytes': self._bytes}
+
+
+# cache shared by all the wavefunctions (see Wavefunction.eigen_cache)
+default_cache = EigenCache()
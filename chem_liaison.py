@@ -4,19 +4,29 @@ class Liaison:
     """
     Classe représentant une liaison.
 
+    Comme Atome, une poignée légère (__slots__) sur une liaison stockée dans les tableaux de
+    Molecule.
+
+    Attributs:
+        atome1 (Atome): L'atome 1.
+        atome2 (Atome): L'atome 2.
+        index (int): L'indice de la liaison dans sa molécule, None si elle n'appartient à aucune.
     """
 
-    def __init__(self, atome1: Atome, atome2: Atome):
+    __slots__ = ('atome1', 'atome2', 'index')
+
+    def __init__(self, atome1: Atome, atome2: Atome, index=None):
         """
         Initialise un objet Liaison.
 
         Args:
-            canvas (tkinter.Canvas): Le canvas sur lequel dessiner l'atome.
             atome1 (Atome): L'atome 1.
             atome2 (Atome): L'atome 2.
+            index (int): L'indice de la liaison dans sa molécule.
         """
         self.atome1 = atome1
         self.atome2 = atome2
+        self.index = index
     
     def get_other_atom(self, atom: Atome):
         """
@@ -1,40 +1,184 @@
+from contextlib import contextmanager
+
+import numpy as np
+
 from chem_atome import Atome
 from chem_liaison import Liaison
 from chem_wavefunction import Wavefunction
-from params import params,TYPE_ATOME
+from params import IS_HUCKEL, PI_ELECTRONS, TYPE_ATOME, TYPE_CODES, TYPES, VALENCES
+
+try:
+    import scipy.sparse
+except ImportError:
+    # only needed by sparse molecules
+    scipy = None
+
+HYDROGEN_CODE = TYPE_CODES[TYPE_ATOME.HYDROGENE]
 
 class Molecule:
     """
     Represents a molecule.
 
+    The atoms and bonds are stored as arrays: an int8 type code per atom (see params.TYPE_CODES) and
+    the int32 pair of atom indices of each bond, in buffers larger than needed. The bonds of each atom
+    are kept in a row of an incidence table updated by every edit, so that neighbour queries and edits
+    cost O(degree). Atome and Liaison objects are light handles on these arrays, created on first
+    access; removing an atom or a bond moves the last one into its slot and updates its handle and the
+    few table entries referring to it.
+
     Attributes:
-    - atomes (list): A list of atoms in the molecule.
-    - liaisons (list): A list of bonds between atoms in the molecule.
-    - wavefunction (Wavefunction): The wavefunction associated with the molecule.
+    - atomes (list): The atoms of the molecule.
+    - liaisons (list): The bonds between atoms in the molecule.
+    - wavefunction (Wavefunction): The wavefunction associated with the molecule, occupied by aufbau
+      with the pi electrons of the molecule.
 
     Methods:
     - update_wavefunction(): Updates the wavefunction of the molecule.
+    - get_number_of_pi_electrons(), set_charge(charge: int): The pi electron count, kept up to date
+      as Huckel atoms are added and removed, and the charge of the molecule.
+    - begin_edit(), commit_edit(), edit(): Group several edits so that the wavefunction is updated once.
     - add_atom(type: TYPE_ATOME): Adds an atom of the specified type to the molecule.
-    - remove_atom(atom: Atome): Removes the specified atom from the molecule.
+    - add_atoms(types), add_bonds(pairs): Add many atoms and bonds at once, by index.
+    - get_atom(index), get_bond(index): Return the handle of an atom or of a bond.
+    - remove_atom(atom: Atome): Removes the specified atom, and its hydrogens, from the molecule.
     - remove_bond(liaison: Liaison): Removes a bond from the molecule.
     - add_bond(atom1: Atome, atom2: Atome): Adds a bond between two atoms in the molecule.
+    - get_bond_between(atom1: Atome, atom2: Atome): Returns the bond between two atoms, or None.
     - get_neighbours(atom: Atome): Returns a list of neighbouring atoms for the given atom.
     - get_huckel_neighbours(atom: Atome): Returns a list of Huckel neighbours for the given atom.
     - get_number_of_bonds(atom: Atome): Returns the number of bonds for the given atom.
     - get_number_of_huckel_bonds(atom: Atome): Returns the number of Huckel bonds for the given atom.
     - generate_huckel_connectivity_matrix(): Generates the Huckel connectivity matrix for the molecule.
+    - get_huckel_atoms(): Returns the Huckel atoms in the order of the rows of the Huckel matrix.
+    - get_huckel_index(atom: Atome): Returns the row of the given atom in the Huckel matrix.
     - has_free_valency(atom: Atome): Checks if the given atom has free valency.
+    - get_implicit_hydrogen_counts(), get_number_of_implicit_hydrogens(atom: Atome): The hydrogens
+      implied by the valences and not present as atoms.
+    - make_hydrogens_explicit(atoms: list): Adds the implicit hydrogens as atoms.
+    - get_pi_charges(), get_bond_orders(), get_free_valences(): Map the pi properties of the
+      wavefunction back to the atoms and bonds.
+    - count_kekule_structures(): Returns the number of Kekule structures of the Huckel graph.
+    - iter_kekule_structures(wavefunctions: bool): Enumerates the Kekule structures lazily.
 
     """
 
-    def __init__(self):
-        self.atomes = []
-        self.liaisons = []
-        self.wavefunction = Wavefunction("molecule", self.generate_huckel_connectivity_matrix(), [0])
+    def __init__(self, sparse=False):
+        """
+        Parameters:
+        - sparse (bool): Keep the Huckel matrix and the wavefunction sparse (requires scipy), for
+          molecules too large for a dense matrix; the matrix is then rebuilt from the bonds at each
+          update instead of being edited in place.
+        """
+        self.sparse = sparse
+        self._types = np.zeros(0, dtype=np.int8)
+        self._bonds = np.zeros((0, 2), dtype=np.int32)
+        self._n_atoms = 0
+        self._n_bonds = 0
+        # handles of the atoms and bonds, None until first accessed
+        self._atom_handles = []
+        self._bond_handles = []
+        # bonds of each atom: the first _degrees[i] entries of row i of _incident, whose width grows
+        # with the largest degree
+        self._incident = np.zeros((0, 4), dtype=np.int32)
+        self._degrees = np.zeros(0, dtype=np.int32)
+        # Huckel row of each atom (-1 for the other atoms) and atom of each Huckel row
+        self._huckel_rows = np.zeros(0, dtype=np.int32)
+        self._huckel_atoms = np.zeros(0, dtype=np.int32)
+        self._n_huckel = 0
+        # The dense Huckel matrix is stored in a buffer larger than needed and kept up to
+        # date in place by the edit methods; only its leading block is meaningful.
+        self._huckel_matrix = np.zeros((0, 0))
+        # changes of the Huckel matrix not yet forwarded to the wavefunction, so that it can
+        # update its eigen-solution instead of diagonalizing again; removals force a full rebuild
+        self._huckel_edits = []
+        self._huckel_rebuild = False
+        self._edit_depth = 0
+        self._wavefunction_outdated = False
+        # pi electrons brought by the Huckel atoms (see params), before the charge is removed
+        self._pi_electrons = 0
+        self.charge = 0
+        self.wavefunction = Wavefunction("molecule", self.generate_huckel_connectivity_matrix(), [0], sparse=sparse)
+        self.wavefunction.set_electron_count(0)
+
+    @property
+    def atomes(self):
+        return [self.get_atom(i) for i in range(self._n_atoms)]
+
+    @property
+    def liaisons(self):
+        return [self.get_bond(b) for b in range(self._n_bonds)]
 
     def update_wavefunction(self):
-        self.wavefunction.set_matrix(self.generate_huckel_connectivity_matrix())
+        if self._edit_depth > 0:
+            # deferred until the outermost commit_edit()
+            self._wavefunction_outdated = True
+            return
+        if self._huckel_rebuild:
+            self.wavefunction.set_matrix(self.generate_huckel_connectivity_matrix())
+        else:
+            for edit in self._huckel_edits:
+                if edit[0] == 'centre':
+                    self.wavefunction.add_centre()
+                else:
+                    self.wavefunction.set_element(*edit[1:])
+        self._huckel_edits = []
+        self._huckel_rebuild = False
+        self._wavefunction_outdated = False
+        self.wavefunction.set_electron_count(self.get_number_of_pi_electrons())
         return
+
+    def get_number_of_pi_electrons(self):
+        """
+        Returns the number of pi electrons of the molecule: those brought by its Huckel atoms minus
+        its charge.
+
+        Returns:
+        - int: The number of pi electrons.
+        """
+        return self._pi_electrons - self.charge
+
+    def set_charge(self, charge):
+        """
+        Sets the charge of the molecule, e.g. +1 for the tropylium cation.
+
+        Parameters:
+        - charge (int): The charge.
+        """
+        self.charge = charge
+        self.update_wavefunction()
+
+    def begin_edit(self):
+        """
+        Starts a batch of edits. Until the matching commit_edit(), the wavefunction is not updated.
+        Batches can be nested; only the outermost commit updates the wavefunction.
+        """
+        self._edit_depth += 1
+
+    def commit_edit(self):
+        """
+        Ends a batch of edits started with begin_edit() and updates the wavefunction once if needed.
+        """
+        if self._edit_depth == 0:
+            raise RuntimeError("commit_edit() called without a matching begin_edit()")
+        self._edit_depth -= 1
+        if self._edit_depth == 0 and self._wavefunction_outdated:
+            self.update_wavefunction()
+
+    @contextmanager
+    def edit(self):
+        """
+        Context manager wrapping begin_edit() and commit_edit().
+
+        Example:
+            with molecule.edit():
+                for atom1, atom2 in bonds:
+                    molecule.add_bond(atom1, atom2)
+        """
+        self.begin_edit()
+        try:
+            yield self
+        finally:
+            self.commit_edit()
     
     def add_atom(self, type: TYPE_ATOME):
         """
@@ -47,12 +191,70 @@ class Molecule:
         - atome (Atome): The newly added atom.
 
         """
-        atome = Atome(type)
-        self.atomes.append(atome)
-        if params[type.value]['isHuckel']:
+        return self.get_atom(self.add_atoms([type])[0])
+
+    def add_atoms(self, types):
+        """
+        Adds atoms without creating their handles, e.g. to build large systems.
+
+        Parameters:
+        - types (list): The types (TYPE_ATOME) of the atoms to add.
+
+        Returns:
+        - numpy.ndarray: The indices of the new atoms.
+        """
+        codes = np.array([TYPE_CODES[type] for type in types], dtype=np.int8)
+        start = self._n_atoms
+        stop = start + len(codes)
+        self._types = _reserve(self._types, stop)
+        self._huckel_rows = _reserve(self._huckel_rows, stop)
+        self._incident = _reserve(self._incident, stop)
+        self._degrees = _reserve(self._degrees, stop)
+        self._types[start:stop] = codes
+        self._huckel_rows[start:stop] = -1
+        self._degrees[start:stop] = 0
+        self._atom_handles.extend([None] * len(codes))
+        self._n_atoms = stop
+        indices = np.arange(start, stop)
+        huckel = indices[IS_HUCKEL[codes]]
+        if len(huckel):
+            self._add_huckel_centres(huckel)
             self.update_wavefunction()
-        return atome
-    
+        return indices
+
+    def get_atom(self, index):
+        """
+        Returns the handle of an atom, created on first access.
+
+        Parameters:
+        - index (int): The index of the atom.
+
+        Returns:
+        - Atome: The atom.
+        """
+        handle = self._atom_handles[index]
+        if handle is None:
+            handle = Atome(TYPES[self._types[index]], int(index))
+            self._atom_handles[index] = handle
+        return handle
+
+    def get_bond(self, index):
+        """
+        Returns the handle of a bond, created on first access.
+
+        Parameters:
+        - index (int): The index of the bond.
+
+        Returns:
+        - Liaison: The bond.
+        """
+        handle = self._bond_handles[index]
+        if handle is None:
+            i, j = self._bonds[index]
+            handle = Liaison(self.get_atom(i), self.get_atom(j), int(index))
+            self._bond_handles[index] = handle
+        return handle
+
     def remove_atom(self, atom: Atome):
         """
         Removes the specified atom from the molecule.
@@ -61,17 +263,25 @@ class Molecule:
             atom (Atome): The atom to be removed.
 
         Returns:
-            None
+            tuple: The removed atoms, i.e. the atom and the hydrogens it carried, and the removed
+            bonds, so that callers can drop what they associated with them.
         """
-        self.atomes.remove(atom)
-        for liaison in self.liaisons:
-            if atom in (liaison.atome1, liaison.atome2):
-                other_atom = liaison.get_other_atom(atom)
-                if other_atom.type == TYPE_ATOME.HYDROGENE:
-                    self.atomes.remove(other_atom)
-                self.liaisons.remove(liaison)
+        # the hydrogens carried by the atom are removed along with it
+        removed = [atom] + [other_atom for other_atom in self.get_neighbours(atom)
+                            if other_atom.type == TYPE_ATOME.HYDROGENE and other_atom is not atom]
+        removed_bonds = set()
+        for removed_atom in removed:
+            removed_bonds.update(self._incident_bonds(removed_atom.index).tolist())
+        # from the last bond down, so that the bonds moved into the freed slots are not pending
+        removed_bonds = sorted(removed_bonds, reverse=True)
+        removed_liaisons = [self.get_bond(b) for b in removed_bonds]
+        for b in removed_bonds:
+            self._remove_bond_at(b)
+        for removed_atom in removed:
+            if removed_atom.index is not None:
+                self._remove_atom_at(removed_atom.index)
         self.update_wavefunction()
-        return
+        return removed, removed_liaisons
     
     def remove_bond(self, liaison: Liaison):
         """
@@ -83,7 +293,9 @@ class Molecule:
         Returns:
             None
         """
-        self.liaisons.remove(liaison)
+        if liaison.index is None or self._bond_handles[liaison.index] is not liaison:
+            raise ValueError("the bond does not belong to the molecule")
+        self._remove_bond_at(liaison.index)
         self.update_wavefunction()
         return
     
@@ -97,12 +309,158 @@ class Molecule:
 
         Returns:
             liaison (Liaison): The newly added bond.
+
+        Raises:
+            ValueError: If the atoms are already bonded, or are the same atom.
+        """
+        return self.get_bond(self.add_bonds([(atom1.index, atom2.index)])[0])
+
+    def get_bond_between(self, atom1: Atome, atom2: Atome):
+        """
+        Returns the bond between two atoms, found among the bonds of the first one.
+
+        Parameters:
+        - atom1 (Atome): The first atom.
+        - atom2 (Atome): The second atom.
+
+        Returns:
+        - Liaison or None: The bond, or None if the atoms are not bonded.
+        """
+        bonds = self._incident_bonds(atom1.index)
+        found = bonds[(self._bonds[bonds] == atom2.index).any(axis=1)]
+        return self.get_bond(found[0]) if len(found) else None
+
+    def add_bonds(self, pairs):
         """
-        liaison = Liaison(atom1, atom2)
-        self.liaisons.append(liaison)
+        Adds bonds between atoms given by their indices, without creating their handles.
+
+        Parameters:
+        - pairs (array-like): The (m, 2) indices of the bonded atoms.
+
+        Returns:
+        - numpy.ndarray: The indices of the new bonds.
+
+        Raises:
+        - ValueError: If a pair bonds an atom to itself, is given twice or is already bonded; a bond
+          appears once in the Huckel matrix, so it can only be added once.
+        """
+        pairs = np.asarray(pairs, dtype=np.int32).reshape(-1, 2)
+        self._check_new_bonds(pairs)
+        start = self._n_bonds
+        stop = start + len(pairs)
+        self._bonds = _reserve(self._bonds, stop)
+        self._bonds[start:stop] = pairs
+        self._bond_handles.extend([None] * len(pairs))
+        self._n_bonds = stop
+        # each end gets the bond in the next free entry of its row, atoms bonded several times in
+        # the batch taking consecutive entries
+        ends = pairs.T.ravel()
+        order = np.argsort(ends, kind='stable')
+        ends = ends[order]
+        slots = self._degrees[ends] + np.arange(len(ends)) - np.searchsorted(ends, ends)
+        if len(slots) and slots.max() >= self._incident.shape[1]:
+            width = max(2 * self._incident.shape[1], int(slots.max()) + 1)
+            incident = np.zeros((len(self._incident), width), dtype=np.int32)
+            incident[:, :self._incident.shape[1]] = self._incident
+            self._incident = incident
+        self._incident[ends, slots] = np.tile(np.arange(start, stop, dtype=np.int32), 2)[order]
+        np.add.at(self._degrees, ends, 1)
+        for i, j in pairs.tolist():
+            self._set_huckel_bond(i, j, 1)
         self.update_wavefunction()
-        return liaison
-    
+        return np.arange(start, stop)
+
+    def _remove_bond_at(self, b):
+        """
+        Removes bond b, moving the last bond into its slot.
+        """
+        i, j = self._bonds[b].tolist()
+        self._set_huckel_bond(i, j, 0)
+        self._detach_bond(i, b)
+        self._detach_bond(j, b)
+        handle = self._bond_handles[b]
+        if handle is not None:
+            handle.index = None
+        last = self._n_bonds - 1
+        if b != last:
+            self._bonds[b] = self._bonds[last]
+            for end in self._bonds[b].tolist():
+                bonds = self._incident_bonds(end)
+                bonds[bonds == last] = b
+            moved = self._bond_handles[last]
+            self._bond_handles[b] = moved
+            if moved is not None:
+                moved.index = b
+        self._bond_handles.pop()
+        self._n_bonds = last
+
+    def _check_new_bonds(self, pairs):
+        """
+        Raises ValueError unless the pairs are distinct, unbonded pairs of distinct atoms, in
+        O(m (log m + maximum degree)).
+        """
+        if np.any(pairs[:, 0] == pairs[:, 1]):
+            raise ValueError("an atom cannot be bonded to itself")
+        if len(np.unique(np.sort(pairs, axis=1), axis=0)) < len(pairs):
+            raise ValueError("the same bond is given twice")
+        # the bonds of the first atom of each pair, -1 past its degree
+        width = int(self._degrees[pairs[:, 0]].max(initial=0))
+        bonds = self._incident[pairs[:, 0], :width]
+        bonds = np.where(np.arange(width) < self._degrees[pairs[:, 0], None], bonds, -1)
+        ends = self._bonds[np.maximum(bonds, 0)]
+        if np.any((bonds >= 0) & (ends == pairs[:, 1, None, None]).any(axis=2)):
+            raise ValueError("the atoms are already bonded")
+
+    def _detach_bond(self, i, b):
+        # removes bond b from the row of atom i, moving the last entry of the row into its place
+        bonds = self._incident_bonds(i)
+        k = int(np.flatnonzero(bonds == b)[0])
+        bonds[k] = bonds[-1]
+        self._degrees[i] -= 1
+
+    def _remove_atom_at(self, i):
+        """
+        Removes atom i, which must not carry any bond anymore, moving the last atom into its slot.
+        """
+        if self._huckel_rows[i] >= 0:
+            self._remove_huckel_centre(i)
+        handle = self._atom_handles[i]
+        if handle is not None:
+            handle.index = None
+        last = self._n_atoms - 1
+        if i != last:
+            self._types[i] = self._types[last]
+            row = self._huckel_rows[last]
+            self._huckel_rows[i] = row
+            if row >= 0:
+                self._huckel_atoms[row] = i
+            # only the bonds of the moved atom refer to it
+            bonds = self._incident_bonds(last)
+            ends = self._bonds[bonds]
+            ends[ends == last] = i
+            self._bonds[bonds] = ends
+            self._incident[i] = self._incident[last]
+            self._degrees[i] = self._degrees[last]
+            moved = self._atom_handles[last]
+            self._atom_handles[i] = moved
+            if moved is not None:
+                moved.index = i
+        self._atom_handles.pop()
+        self._n_atoms = last
+
+    def _incident_bonds(self, i):
+        """
+        Returns the bonds of atom i, as a view of its row of the incidence table.
+
+        Returns:
+        - numpy.ndarray: The indices of the bonds.
+        """
+        return self._incident[i, :self._degrees[i]]
+
+    def _neighbour_indices(self, atom: Atome):
+        ends = self._bonds[self._incident_bonds(atom.index)]
+        return np.where(ends[:, 0] == atom.index, ends[:, 1], ends[:, 0])
+
     def get_neighbours(self, atom: Atome):
         """
         Returns a list of neighbouring atoms for the given atom.
@@ -113,13 +471,7 @@ class Molecule:
         Returns:
         - list: A list of neighbouring atoms.
         """
-        neighbours = []
-        for liaison in self.liaisons:
-            if atom == liaison.atome1:
-                neighbours.append(liaison.atome2)
-            elif atom == liaison.atome2:
-                neighbours.append(liaison.atome1)
-        return neighbours
+        return [self.get_atom(j) for j in self._neighbour_indices(atom)]
     
     def get_huckel_neighbours(self, atom: Atome):
         """
@@ -131,13 +483,8 @@ class Molecule:
         Returns:
         - huckel_neighbours (list): A list of atoms that are Huckel neighbours of the given atom.
         """
-        huckel_neighbours = []
-        for liaison in self.liaisons:
-            if atom in (liaison.atome1, liaison.atome2):
-                other_atom = liaison.get_other_atom(atom)
-                if params[other_atom.type.value]['isHuckel']:
-                    huckel_neighbours.append(other_atom)
-        return huckel_neighbours
+        neighbours = self._neighbour_indices(atom)
+        return [self.get_atom(j) for j in neighbours[IS_HUCKEL[self._types[neighbours]]]]
     
     def get_non_huckel_neighbours(self, atom: Atome):
         """
@@ -149,13 +496,8 @@ class Molecule:
         Returns:
         - non_huckel_neighbours (list): A list of atoms that are not Huckel neighbours of the given atom.
         """
-        non_huckel_neighbours = []
-        for liaison in self.liaisons:
-            if atom in (liaison.atome1, liaison.atome2):
-                other_atom = liaison.get_other_atom(atom)
-                if not params[other_atom.type.value]['isHuckel']:
-                    non_huckel_neighbours.append(other_atom)
-        return non_huckel_neighbours
+        neighbours = self._neighbour_indices(atom)
+        return [self.get_atom(j) for j in neighbours[~IS_HUCKEL[self._types[neighbours]]]]
     
     def get_number_of_bonds(self, atom: Atome):
         """
@@ -167,7 +509,7 @@ class Molecule:
         Returns:
         - int: The number of bonds.
         """
-        return len(self.get_neighbours(atom))
+        return int(self._degrees[atom.index])
     
     def get_number_of_huckel_bonds(self, atom: Atome):
         """
@@ -179,25 +521,123 @@ class Molecule:
         Returns:
         - int: The number of Huckel bonds.
         """
-        return len(self.get_huckel_neighbours(atom))
+        return int(np.count_nonzero(IS_HUCKEL[self._types[self._neighbour_indices(atom)]]))
     
     def generate_huckel_connectivity_matrix(self):
         """
         Generates the Huckel connectivity matrix for the molecule.
 
+        Rows and columns follow the order of get_huckel_atoms(); non-Huckel atoms
+        do not appear in the matrix.
+
         Returns:
-        - matrix (list): The Huckel connectivity matrix.
+        - matrix (numpy.ndarray): A copy of the Huckel connectivity matrix, or a scipy.sparse CSR
+          matrix built from the bonds for a sparse molecule.
         """
-        matrix = []
-        for i in range(len(self.atomes)):
-            row = []
-            for j in range(len(self.atomes)):
-                if self.atomes[j] in self.get_huckel_neighbours(self.atomes[i]):
-                    row.append(1)
-                else:
-                    row.append(0)
-            matrix.append(row)
-        return matrix
+        n = self._n_huckel
+        if self.sparse:
+            rows = self._huckel_rows[self._bonds[:self._n_bonds]]
+            rows = rows[(rows >= 0).all(axis=1)]
+            matrix = scipy.sparse.coo_matrix((np.ones(len(rows)), (rows[:, 0], rows[:, 1])), shape=(n, n)).tocsr()
+            # duplicated bonds count once, like in the dense matrix
+            matrix = matrix + matrix.T
+            matrix.data[:] = 1
+            return matrix
+        return self._huckel_matrix[:n, :n].copy()
+
+    def _dense_huckel_matrix(self):
+        matrix = self.generate_huckel_connectivity_matrix()
+        return matrix.toarray() if self.sparse else matrix
+
+    def get_huckel_atoms(self):
+        """
+        Returns the Huckel atoms in the order of the rows of the Huckel matrix.
+
+        Returns:
+        - list: The Huckel atoms.
+        """
+        return [self.get_atom(i) for i in self._huckel_atoms[:self._n_huckel]]
+
+    def get_huckel_index(self, atom: Atome):
+        """
+        Returns the row of the given atom in the Huckel matrix.
+
+        Parameters:
+        - atom (Atome): The atom to look up.
+
+        Returns:
+        - int or None: The row index, or None if the atom is not a Huckel centre.
+        """
+        if atom.index is None:
+            return None
+        row = int(self._huckel_rows[atom.index])
+        return row if row >= 0 else None
+
+    def _add_huckel_centres(self, atoms):
+        """
+        Appends isolated Huckel centres for the given atoms to the Huckel matrix, growing the buffer if
+        needed.
+        """
+        n = self._n_huckel
+        stop = n + len(atoms)
+        self._huckel_atoms = _reserve(self._huckel_atoms, stop)
+        self._huckel_atoms[n:stop] = atoms
+        self._huckel_rows[atoms] = np.arange(n, stop)
+        self._n_huckel = stop
+        self._pi_electrons += int(PI_ELECTRONS[self._types[atoms]].sum())
+        if self.sparse:
+            self._huckel_rebuild = True
+            return
+        if stop > len(self._huckel_matrix):
+            capacity = max(2*n, stop, 8)
+            matrix = np.zeros((capacity, capacity))
+            matrix[:n, :n] = self._huckel_matrix[:n, :n]
+            self._huckel_matrix = matrix
+        self._huckel_edits.extend([('centre',)] * len(atoms))
+
+    def _remove_huckel_centre(self, atom):
+        """
+        Removes the isolated Huckel centre of atom from the Huckel matrix.
+
+        The last centre is moved into the freed row and column so that the matrix stays contiguous.
+        The centre must not carry any Huckel bond anymore.
+        """
+        i = int(self._huckel_rows[atom])
+        self._huckel_rows[atom] = -1
+        self._pi_electrons -= int(PI_ELECTRONS[self._types[atom]])
+        last = self._n_huckel - 1
+        moved = self._huckel_atoms[last]
+        self._n_huckel = last
+        self._huckel_rebuild = True
+        if i != last:
+            self._huckel_atoms[i] = moved
+            self._huckel_rows[moved] = i
+        if self.sparse:
+            return
+        matrix = self._huckel_matrix
+        if i != last:
+            diagonal = matrix[last, last]
+            matrix[i, :last] = matrix[last, :last]
+            matrix[:last, i] = matrix[:last, last]
+            matrix[i, i] = diagonal
+        matrix[last, :last+1] = 0
+        matrix[:last+1, last] = 0
+
+    def _set_huckel_bond(self, atom1, atom2, value):
+        """
+        Sets the Huckel matrix element between two atoms, given by their indices, if both are Huckel
+        centres.
+        """
+        i = int(self._huckel_rows[atom1])
+        j = int(self._huckel_rows[atom2])
+        if i < 0 or j < 0:
+            return
+        if self.sparse:
+            self._huckel_rebuild = True
+            return
+        self._huckel_matrix[i, j] = value
+        self._huckel_matrix[j, i] = value
+        self._huckel_edits.append(('bond', i, j, value))
     
     def has_free_valency(self, atom: Atome):
         """
@@ -209,5 +649,324 @@ class Molecule:
         Returns:
         - bool: True if the atom has free valency, False otherwise.
         """
-        return self.get_number_of_huckel_bonds(atom) < atom.get_valence()
+        return self.get_number_of_huckel_bonds(atom) < VALENCES[self._types[atom.index]]
+
+    def get_implicit_hydrogen_counts(self):
+        """
+        Returns the number of implicit hydrogens of every atom: the valence of the atom minus its
+        bonds, explicit hydrogens included, for the atoms other than hydrogens. Hydrogens are thus
+        tracked as counts, and only become atoms through make_hydrogens_explicit.
+
+        Returns:
+        - numpy.ndarray: The number of implicit hydrogens of each atom, indexed like the atoms.
+        """
+        types = self._types[:self._n_atoms]
+        counts = np.maximum(VALENCES[types] - self._degrees[:self._n_atoms], 0)
+        counts[types == HYDROGEN_CODE] = 0
+        return counts
+
+    def get_number_of_implicit_hydrogens(self, atom: Atome):
+        """
+        Returns the number of implicit hydrogens of the given atom, see get_implicit_hydrogen_counts.
+
+        Parameters:
+        - atom (Atome): The atom.
+
+        Returns:
+        - int: The number of implicit hydrogens.
+        """
+        if self._types[atom.index] == HYDROGEN_CODE:
+            return 0
+        return max(int(VALENCES[self._types[atom.index]]) - self.get_number_of_bonds(atom), 0)
+
+    def make_hydrogens_explicit(self, atoms=None):
+        """
+        Adds the implicit hydrogens of the given atoms as hydrogen atoms bonded to them. Hydrogens are
+        not Huckel atoms, so the wavefunction is left unchanged.
+
+        Parameters:
+        - atoms (list): The atoms whose hydrogens are added, all the atoms by default.
+
+        Returns:
+        - list: The new bonds, from each atom (atome1) to one of its hydrogens (atome2).
+        """
+        counts = self.get_implicit_hydrogen_counts()
+        indices = np.arange(self._n_atoms) if atoms is None else np.array([atom.index for atom in atoms], dtype=np.int64)
+        parents = np.repeat(indices, counts[indices])
+        with self.edit():
+            hydrogens = self.add_atoms([TYPE_ATOME.HYDROGENE] * len(parents))
+            bonds = self.add_bonds(np.column_stack((parents, hydrogens)))
+        return [self.get_bond(b) for b in bonds]
+
+    def get_pi_charges(self):
+        """
+        Returns the pi charges of the Huckel atoms, see Wavefunction.get_pi_properties.
+
+        Returns:
+        - dict: The charge of each Huckel atom.
+        """
+        charges = self.wavefunction.get_charges()
+        return dict(zip(self.get_huckel_atoms(), charges))
+
+    def get_bond_orders(self):
+        """
+        Returns the pi bond orders of the bonds between Huckel atoms, computed for these bonds only.
+
+        Returns:
+        - dict: The bond order of each bond between two Huckel atoms.
+        """
+        rows = self._huckel_rows[self._bonds[:self._n_bonds]]
+        bonds = np.flatnonzero((rows >= 0).all(axis=1))
+        orders = self.wavefunction.get_bond_orders(rows[bonds, 0], rows[bonds, 1])
+        return {self.get_bond(b): order for b, order in zip(bonds, orders)}
+
+    def get_free_valences(self):
+        """
+        Returns the free valences of the Huckel atoms, see Wavefunction.get_pi_properties.
+
+        Returns:
+        - dict: The free valence of each Huckel atom.
+        """
+        free_valences = self.wavefunction.get_free_valences()
+        return dict(zip(self.get_huckel_atoms(), free_valences))
+
+    def count_kekule_structures(self):
+        """
+        Returns the number of Kekule structures, i.e. of perfect matchings of the Huckel graph,
+        without enumerating them.
 
+        Returns:
+        - int: The number of Kekule structures.
+        """
+        return count_perfect_matchings(self._dense_huckel_matrix())
+
+    def iter_kekule_structures(self, wavefunctions=False):
+        """
+        Enumerates the Kekule structures of the Huckel graph lazily, see iter_perfect_matchings.
+
+        Parameters:
+        - wavefunctions (bool): Yield each structure as a Wavefunction, whose matrix only keeps the
+          double bonds of the structure and whose occupation is that of the molecule with one pi
+          electron per centre, instead of as a matching array.
+
+        Returns:
+        - generator: The arrays of the partner of each Huckel centre in the double bonds, indexed like
+          the Huckel matrix, or the wavefunctions named kekule1, kekule2, ...
+        """
+        matrix = self._dense_huckel_matrix()
+        n = len(matrix)
+        centres = np.arange(n)
+        for k, partners in enumerate(iter_perfect_matchings(matrix)):
+            if not wavefunctions:
+                yield partners
+                continue
+            structure = np.diag(np.diag(matrix))
+            structure[centres, partners] = matrix[centres, partners]
+            yield Wavefunction("kekule{}".format(k + 1), structure, [2] * (n // 2) + [0] * (n - n // 2))
+
+
+def _reserve(array, size):
+    """
+    Returns array, or a copy of it with at least twice its capacity along the first axis if it holds
+    fewer than size entries; the extra entries are zero.
+    """
+    if size <= len(array):
+        return array
+    grown = np.zeros((max(2 * len(array), size, 8),) + array.shape[1:], dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+def _frontier_order(neighbours):
+    """
+    Orders the vertices of a graph to keep the frontier of the transfer-matrix sweep narrow:
+    Cuthill-McKee, i.e. breadth-first from a pseudo-peripheral vertex of each connected component,
+    visiting the neighbours by increasing degree.
+
+    Parameters:
+    - neighbours (list): The list of the neighbours of each vertex.
+
+    Returns:
+    - list: The vertices in sweep order.
+    """
+    n = len(neighbours)
+    degree = [len(vertex_neighbours) for vertex_neighbours in neighbours]
+
+    def breadth_first(start, seen):
+        order = [start]
+        seen[start] = True
+        for vertex in order:
+            for neighbour in sorted(neighbours[vertex], key=degree.__getitem__):
+                if not seen[neighbour]:
+                    seen[neighbour] = True
+                    order.append(neighbour)
+        return order
+
+    order = []
+    placed = [False] * n
+    for root in range(n):
+        if placed[root]:
+            continue
+        # a pseudo-peripheral start: the last vertex reached from the last vertex reached from root
+        start = root
+        for _ in range(2):
+            start = breadth_first(start, list(placed))[-1]
+        order.extend(breadth_first(start, placed))
+    return order
+
+
+class _TransferMatrix:
+    """
+    Transfer-matrix sweep over the perfect matchings of a graph.
+
+    The vertices are processed in frontier order. After step t the state is the set of processed
+    vertices still waiting for a partner, as a bit mask of sweep positions. Processing a vertex
+    either matches it with a waiting earlier neighbour or leaves it waiting; a waiting vertex whose
+    neighbours have all been processed is a dead end and its state is dropped. The number of states
+    is bounded by the subsets of the frontier, which stays narrow for polycyclic systems.
+    """
+
+    def __init__(self, matrix):
+        matrix = np.asarray(matrix)
+        self.n = len(matrix)
+        rows, cols = np.nonzero(matrix)
+        neighbours = [[] for _ in range(self.n)]
+        for i, j in zip(rows.tolist(), cols.tolist()):
+            if i != j:
+                neighbours[i].append(j)
+        self.order = _frontier_order(neighbours)
+        position = [0] * self.n
+        for t, vertex in enumerate(self.order):
+            position[vertex] = t
+        # for each step, the earlier neighbours of the vertex (mask) and the positions that can no
+        # longer be matched once it is processed (mask)
+        self.earlier = []
+        self.expired = []
+        last = [max([position[neighbour] for neighbour in neighbours[vertex]], default=-1) for vertex in self.order]
+        expiring = [0] * self.n
+        for t in range(self.n):
+            expiring[max(last[t], t)] |= 1 << t
+        expired = 0
+        for t, vertex in enumerate(self.order):
+            mask = 0
+            for neighbour in neighbours[vertex]:
+                if position[neighbour] < t:
+                    mask |= 1 << position[neighbour]
+            self.earlier.append(mask)
+            expired |= expiring[t]
+            self.expired.append(expired)
+
+    def transitions(self, t, state):
+        """
+        Yields:
+        - tuple: The next state and the sweep position matched with the vertex of step t, or -1 if it
+          is left waiting.
+        """
+        expired = self.expired[t]
+        waiting = state | (1 << t)
+        if not waiting & expired:
+            yield waiting, -1
+        candidates = state & self.earlier[t]
+        while candidates:
+            bit = candidates & -candidates
+            candidates ^= bit
+            matched = state ^ bit
+            if not matched & expired:
+                yield matched, bit.bit_length() - 1
+
+    def count(self):
+        # forward sweep keeping only the current layer of states
+        if self.n % 2:
+            return 0
+        layer = {0: 1}
+        for t in range(self.n):
+            following = {}
+            for state, count in layer.items():
+                for next_state, _ in self.transitions(t, state):
+                    following[next_state] = following.get(next_state, 0) + count
+            layer = following
+        return layer.get(0, 0)
+
+    def completions(self):
+        """
+        Returns:
+        - list: For each step t, a dict mapping each state of step t that can be completed into a
+          perfect matching to the number of completions and to its transitions towards such states.
+        """
+        if self.n % 2:
+            return None
+        layers = [{0}]
+        for t in range(self.n):
+            layers.append({next_state for state in layers[t] for next_state, _ in self.transitions(t, state)})
+        dag = [None] * (self.n + 1)
+        dag[self.n] = {0: (1, [])} if 0 in layers[self.n] else {}
+        for t in range(self.n - 1, -1, -1):
+            following = dag[t + 1]
+            layer = {}
+            for state in layers[t]:
+                transitions = [(next_state, matched) for next_state, matched in self.transitions(t, state)
+                               if next_state in following]
+                if transitions:
+                    layer[state] = (sum(following[next_state][0] for next_state, _ in transitions), transitions)
+            dag[t] = layer
+            layers[t + 1] = None
+        return dag
+
+
+def count_perfect_matchings(matrix):
+    """
+    Counts the perfect matchings (Kekule structures) of the graph of the non-zero off-diagonal
+    elements of a matrix by a transfer-matrix sweep, with exact integer arithmetic.
+
+    Parameters:
+    - matrix (numpy.ndarray): The Huckel connectivity matrix.
+
+    Returns:
+    - int: The number of perfect matchings.
+    """
+    return _TransferMatrix(matrix).count()
+
+
+def iter_perfect_matchings(matrix):
+    """
+    Enumerates the perfect matchings (Kekule structures) of the graph of the non-zero off-diagonal
+    elements of a matrix, lazily.
+
+    The transfer-matrix sweep first builds the graph of the states that can be completed into a
+    perfect matching; the enumeration then walks it depth first, so that it never backtracks out of
+    a dead end.
+
+    Parameters:
+    - matrix (numpy.ndarray): The Huckel connectivity matrix.
+
+    Returns:
+    - generator: For each perfect matching, the int32 array of the partner of each centre.
+    """
+    sweep = _TransferMatrix(matrix)
+    dag = sweep.completions()
+    n = sweep.n
+    if not dag or 0 not in dag[0]:
+        return
+    if n == 0:
+        yield np.empty(0, dtype=np.int32)
+        return
+    order = np.array(sweep.order)
+    # partner position of each sweep position along the current path
+    partner = np.empty(n, dtype=np.int64)
+    partners = np.empty(n, dtype=np.int32)
+    stack = [(0, iter(dag[0][0][1]))]
+    while stack:
+        t, choices = stack[-1]
+        choice = next(choices, None)
+        if choice is None:
+            stack.pop()
+            continue
+        next_state, matched = choice
+        if matched >= 0:
+            partner[t] = matched
+            partner[matched] = t
+        if t + 1 == n:
+            partners[order] = order[partner]
+            yield partners.copy()
+        else:
+            stack.append((t + 1, iter(dag[t + 1][next_state][1])))
@@ -0,0 +1,277 @@
+import hashlib
+import logging
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+import chem_cache
+
+logger = logging.getLogger(__name__)
+
+# memory allowed for the overlap matrices of one tile, in bytes
+TILE_MEMORY = 64 * 2**20
+
+
+def occupied_blocks(wavefunctions):
+    """
+    Returns:
+        list: The occupied blocks of the wavefunctions (see Wavefunction.get_occupied_block).
+    """
+    return [wf.get_occupied_block() for wf in wavefunctions]
+
+
+def log_overlap_tile(blocks_i, blocks_j):
+    """
+    Overlaps between two stacks of occupied blocks of the same shape, from one matrix product (all
+    the orbital overlaps of the tile in a single GEMM) and one batched slogdet.
+
+    Args:
+        blocks_i (numpy.ndarray): The (I, n, o) stack of the row occupied blocks.
+        blocks_j (numpy.ndarray): The (J, n, o) stack of the column occupied blocks.
+
+    Returns:
+        tuple: The (I, J) arrays of the signs and of the logarithms of the absolute overlaps.
+    """
+    I, n, o = blocks_i.shape
+    J = len(blocks_j)
+    rows = blocks_i.transpose(0, 2, 1).reshape(I * o, n)
+    cols = blocks_j.transpose(1, 0, 2).reshape(n, J * o)
+    overlaps = (rows @ cols).reshape(I, o, J, o).transpose(0, 2, 1, 3)
+    return np.linalg.slogdet(overlaps)
+
+
+def _tile_task(blocks_i, blocks_j):
+    # signs and logs of a tile given as sequences of occupied blocks, possibly of different shapes;
+    # pairs of different shapes have no overlap
+    signs = np.full((len(blocks_i), len(blocks_j)), np.nan)
+    logs = np.full((len(blocks_i), len(blocks_j)), np.nan)
+    shapes_i = [block.shape for block in blocks_i]
+    shapes_j = [block.shape for block in blocks_j]
+    for shape in set(shapes_i) & set(shapes_j):
+        rows = [i for i, s in enumerate(shapes_i) if s == shape]
+        cols = [j for j, s in enumerate(shapes_j) if s == shape]
+        tile = log_overlap_tile(np.stack([blocks_i[i] for i in rows]), np.stack([blocks_j[j] for j in cols]))
+        signs[np.ix_(rows, cols)], logs[np.ix_(rows, cols)] = tile
+    return signs, logs
+
+
+def gather_overlap(block, support):
+    """
+    Orbital overlaps between an occupied block and orbitals given by their two-centre support (see
+    Wavefunction.get_orbital_support): each overlap gathers two rows of the block, in O(n o) instead
+    of the O(n o^2) of a matrix product.
+
+    Args:
+        block (numpy.ndarray): The (n, o) occupied block.
+        support (tuple): The centres, partners, coefficients and partner coefficients of the p orbitals.
+
+    Returns:
+        numpy.ndarray: The (o, p) overlap matrix.
+    """
+    centres, partners, coefficients, partner_coefficients = support
+    return (block[centres] * coefficients[:, None] + block[partners] * partner_coefficients[:, None]).T
+
+
+def log_overlap_row(block, blocks, supports=None):
+    """
+    Overlaps of one occupied block with many, e.g. of a delocalized reference with all the
+    structures of a decomposition: one GEMM against the stacked blocks and one batched slogdet.
+    Structures given by their orbital support are gathered from the rows of the block instead.
+
+    Args:
+        block (numpy.ndarray): The (n, o) occupied block of the reference.
+        blocks (list): The K occupied blocks to compare with it, None where a support is given.
+        supports (list): The K occupied orbital supports, or None entries for the blocks.
+
+    Returns:
+        tuple: The arrays of the K signs and of the K logarithms of the absolute overlaps, NaN for the
+        blocks of a different shape.
+    """
+    signs = np.full(len(blocks), np.nan)
+    logs = np.full(len(blocks), np.nan)
+    o = block.shape[1]
+    if supports is not None:
+        members = [k for k, support in enumerate(supports) if support is not None and len(support[0]) == o]
+        if members:
+            centres, partners, coefficients, partner_coefficients = (np.stack([supports[k][a] for k in members]) for a in range(4))
+            overlaps = block[centres] * coefficients[..., None] + block[partners] * partner_coefficients[..., None]
+            signs[members], logs[members] = np.linalg.slogdet(overlaps)
+    members = [k for k, other in enumerate(blocks) if other is not None and other.shape == block.shape]
+    if members:
+        # the candidate blocks side by side, so that all their overlaps come from one GEMM
+        overlaps = block.T @ np.concatenate([blocks[k] for k in members], axis=1)
+        signs[members], logs[members] = np.linalg.slogdet(overlaps.reshape(o, len(members), o).transpose(1, 0, 2))
+    return signs, logs
+
+
+def _upper_tiles(count, tile_size):
+    # the tiles on and above the diagonal of a count x count matrix
+    for a in range(0, count, tile_size):
+        for b in range(a, count, tile_size):
+            yield slice(a, a + tile_size), slice(b, b + tile_size)
+
+
+def _default_tile_size(blocks):
+    largest = max((block.shape[1] for block in blocks), default=1)
+    return max(int(np.sqrt(TILE_MEMORY / (8 * max(largest, 1)**2))), 1)
+
+
+def _compute_tiles(blocks, tiles, n_workers, processes):
+    """
+    Computes the tiles in the calling thread or on a pool, keeping at most two tiles per worker in
+    flight.
+
+    Yields:
+        tuple: The row slice, the column slice and the (signs, logs) of each tile, in tile order.
+    """
+    if n_workers <= 1:
+        for rows, cols in tiles:
+            yield rows, cols, _tile_task(blocks[rows], blocks[cols])
+        return
+    executor = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with executor(max_workers=n_workers) as pool:
+        pending = deque()
+        for rows, cols in tiles:
+            pending.append((rows, cols, pool.submit(_tile_task, blocks[rows], blocks[cols])))
+            if len(pending) >= 2 * n_workers:
+                rows, cols, future = pending.popleft()
+                yield rows, cols, future.result()
+        while pending:
+            rows, cols, future = pending.popleft()
+            yield rows, cols, future.result()
+
+
+def _block_array(wavefunctions):
+    # object array of the occupied blocks, sliced by tile without copying the blocks
+    blocks = np.empty(len(wavefunctions), dtype=object)
+    blocks[:] = occupied_blocks(wavefunctions)
+    return blocks
+
+
+def _input_fingerprint(wavefunctions):
+    # hash of the names, matrices and occupations of the wavefunctions, as a signed 64-bit integer
+    digest = hashlib.blake2b(digest_size=8)
+    for wf in wavefunctions:
+        matrix = wf.get_matrix()
+        if hasattr(matrix, 'tocsr'):
+            # a sparse matrix is hashed through its CSR arrays rather than expanded
+            matrix = matrix.tocsr()
+            key = '/'.join(chem_cache.matrix_key(array) for array in (matrix.data, matrix.indices, matrix.indptr))
+            key += str(matrix.shape)
+        else:
+            key = chem_cache.matrix_key(matrix)
+        digest.update(str(wf.name).encode('utf-8') + b'\0' + key.encode('ascii'))
+        digest.update(np.asarray(wf.get_occupation(), dtype=np.float64).tobytes())
+    return int(np.frombuffer(digest.digest(), dtype=np.int64)[0])
+
+
+def overlap_matrix(wavefunctions, log=False, n_workers=1, processes=False, tile_size=None):
+    """
+    Computes the overlaps between all pairs of wavefunctions.
+
+    The occupied blocks are built once per wavefunction. Only the tiles of the upper triangle are
+    computed, the overlap being symmetric, and the tiles are spread over a pool of n_workers threads
+    or processes. Pairs whose occupied blocks differ in shape have no overlap and are set to NaN.
+
+    Args:
+        wavefunctions (list): The K wavefunctions.
+        log (bool): Return signs and logarithms of the absolute overlaps instead of the overlaps, which
+            does not underflow for large systems.
+        n_workers (int): The number of workers; 1 computes the tiles in the calling thread.
+        processes (bool): Use a process pool instead of a thread pool.
+        tile_size (int): The number of wavefunctions per tile side; by default the tile matrices fit
+            in TILE_MEMORY.
+
+    Returns:
+        numpy.ndarray: The (K, K) overlap matrix, or the tuple of the (K, K) sign and log arrays with
+        log.
+    """
+    blocks = _block_array(wavefunctions)
+    K = len(blocks)
+    signs = np.empty((K, K))
+    logs = np.empty((K, K))
+    tiles = _upper_tiles(K, tile_size or _default_tile_size(blocks))
+    for rows, cols, (tile_signs, tile_logs) in _compute_tiles(blocks, tiles, n_workers, processes):
+        signs[rows, cols], logs[rows, cols] = tile_signs, tile_logs
+        signs[cols, rows], logs[cols, rows] = tile_signs.T, tile_logs.T
+    if log:
+        return signs, logs
+    return signs * np.exp(logs)
+
+
+def write_overlap_matrix(wavefunctions, file_path, log=False, n_workers=1, processes=False, tile_size=None,
+                         progress=None):
+    """
+    Streams the overlaps between all pairs of wavefunctions to a memory-mapped .npy file, tile by tile,
+    so that only the occupied blocks and the tiles being computed are held in memory.
+
+    The completed tiles are recorded in a progress file next to the output (file_path + '.progress'),
+    updated after each tile has been flushed to disk. When it exists and matches the wavefunction
+    count, the tile size and a fingerprint of the inputs (the names, matrices and occupations of the
+    wavefunctions), an interrupted run resumes from the tiles not yet completed; otherwise the progress
+    is discarded. The progress file is removed once the matrix is complete.
+
+    Args:
+        wavefunctions (list): The K wavefunctions.
+        file_path (str): The path of the .npy file.
+        log (bool): Write the (2, K, K) array of the signs and of the logarithms of the absolute
+            overlaps instead of the (K, K) overlaps.
+        n_workers (int): The number of workers; 1 computes the tiles in the calling thread.
+        processes (bool): Use a process pool instead of a thread pool.
+        tile_size (int): The number of wavefunctions per tile side; by default the tile matrices fit
+            in TILE_MEMORY.
+        progress (callable): Called as progress(done, total) after each tile.
+
+    Returns:
+        int: The number of tiles computed by this call.
+    """
+    blocks = _block_array(wavefunctions)
+    K = len(blocks)
+    tile_size = tile_size or _default_tile_size(blocks)
+    tiles = list(_upper_tiles(K, tile_size))
+    shape = (2, K, K) if log else (K, K)
+    progress_path = file_path + '.progress'
+    fingerprint = _input_fingerprint(wavefunctions)
+
+    # progress file: K, the tile size, the input fingerprint, then one flag per tile
+    done = None
+    if os.path.exists(progress_path) and os.path.exists(file_path):
+        done = np.load(progress_path, mmap_mode='r+')
+        output = np.load(file_path, mmap_mode='r+')
+        if (len(done) != 3 + len(tiles) or done[0] != K or done[1] != tile_size or done[2] != fingerprint
+                or output.shape != shape):
+            logger.info("Discarding the incompatible progress of %s", file_path)
+            del done, output
+            done = None
+    if done is None:
+        output = np.lib.format.open_memmap(file_path, mode='w+', dtype=np.float64, shape=shape)
+        done = np.lib.format.open_memmap(progress_path, mode='w+', dtype=np.int64, shape=(3 + len(tiles),))
+        done[:3] = K, tile_size, fingerprint
+        done.flush()
+    n_done = int(np.count_nonzero(done[3:]))
+    if n_done:
+        logger.info("Resuming %s: %d of %d tiles already computed", file_path, n_done, len(tiles))
+
+    remaining = [index for index in range(len(tiles)) if not done[3 + index]]
+    computed = 0
+    results = _compute_tiles(blocks, [tiles[index] for index in remaining], n_workers, processes)
+    for index, (rows, cols, (tile_signs, tile_logs)) in zip(remaining, results):
+        if log:
+            output[0, rows, cols], output[1, rows, cols] = tile_signs, tile_logs
+            output[0, cols, rows], output[1, cols, rows] = tile_signs.T, tile_logs.T
+        else:
+            overlaps = tile_signs * np.exp(tile_logs)
+            output[rows, cols] = overlaps
+            output[cols, rows] = overlaps.T
+        # the tile is marked as done only once it is on disk
+        output.flush()
+        done[3 + index] = 1
+        done.flush()
+        computed += 1
+        if progress is not None:
+            progress(n_done + computed, len(tiles))
+    del output, done
+    os.remove(progress_path)
+    return computed
@@ -0,0 +1,171 @@
+import logging
+import os
+import tempfile
+
+import numpy as np
+
+from chem_overlap import overlap_matrix, write_overlap_matrix
+
+logger = logging.getLogger(__name__)
+
+
+class ResonanceWeights:
+    """
+    Weights of a set of structures in a reference wavefunction.
+
+    The reference is expanded as psi = sum_k c_k phi_k in the least-squares sense, i.e. S c = b with
+    S the structure-structure overlap matrix and b the structure-reference overlaps.
+
+    Attributes:
+        coefficients (numpy.ndarray): The expansion coefficients c.
+        weights (numpy.ndarray): The Chirgwin-Coulson weights c_k (S c)_k, summing to the squared norm
+            of the projection of the reference on the structures.
+        normalized_weights (numpy.ndarray): The weights scaled to sum to 1.
+        residual (float): The squared distance 1 - c.b between the reference and its projection.
+        method (str): The solver used: cholesky, eigen or cg.
+    """
+
+    def __init__(self, coefficients, projection, overlaps, method):
+        self.coefficients = coefficients
+        self.weights = coefficients * projection
+        total = self.weights.sum()
+        self.normalized_weights = self.weights / total if total else self.weights
+        self.residual = 1.0 - float(coefficients @ overlaps)
+        self.method = method
+
+
+def _solve_cholesky(S, b, max_condition):
+    # fast path: S = L L^T, with the condition number estimated from the diagonal of L
+    L = np.linalg.cholesky(S)
+    diagonal = np.diag(L)
+    if (diagonal.max() / diagonal.min())**2 > max_condition:
+        raise np.linalg.LinAlgError("overlap matrix too ill-conditioned for the Cholesky path")
+    y = np.linalg.solve(L, b)
+    return np.linalg.solve(L.T, y)
+
+
+def _solve_eigen(S, b, regularization):
+    # regularized fallback: the least-squares solution with the eigenvalues of S below
+    # regularization * max(eigenvalue) discarded, i.e. the structures' near-linear dependencies
+    eigenvalues, eigenvectors = np.linalg.eigh(S)
+    kept = eigenvalues > regularization * max(eigenvalues.max(), 0.0)
+    projected = eigenvectors[:, kept].T @ b
+    return eigenvectors[:, kept] @ (projected / eigenvalues[kept])
+
+
+def _solve_cg(matvec, b, shift, tolerance, max_iterations):
+    """
+    Conjugate gradient for (S + shift I) c = b, with S only available through its products with
+    vectors. The shift regularizes near-singular overlap matrices.
+    """
+    c = np.zeros_like(b)
+    r = b.copy()
+    p = r.copy()
+    rr = r @ r
+    norm_b = np.sqrt(b @ b)
+    for iteration in range(max_iterations):
+        if np.sqrt(rr) <= tolerance * norm_b:
+            break
+        q = matvec(p) + shift * p
+        alpha = rr / (p @ q)
+        c += alpha * p
+        r -= alpha * q
+        rr_next = r @ r
+        p = r + (rr_next / rr) * p
+        rr = rr_next
+        logger.debug("CG iteration %d, residual %g", iteration + 1, np.sqrt(rr) / norm_b)
+    else:
+        logger.warning("CG did not converge in %d iterations (residual %g)", max_iterations, np.sqrt(rr) / norm_b)
+    return c
+
+
+def overlap_matvec(overlaps, row_chunk=1024):
+    """
+    Returns the product v -> S v with the structure-structure overlap matrix S, streamed by blocks of
+    row_chunk rows from an array-like, e.g. the memory-mapped file written by
+    chem_overlap.write_overlap_matrix, so that S is never held in memory as a whole.
+
+    Returns:
+        callable: The product with S.
+    """
+    K = len(overlaps)
+
+    def matvec(v):
+        result = np.empty(K)
+        for start in range(0, K, row_chunk):
+            result[start:start + row_chunk] = np.asarray(overlaps[start:start + row_chunk]) @ v
+        return result
+    return matvec
+
+
+def _weights_cg(overlaps, b, regularization, tolerance, max_iterations):
+    matvec = overlap_matvec(overlaps)
+    c = _solve_cg(matvec, b, regularization, tolerance, max_iterations or max(len(b), 1))
+    return ResonanceWeights(c, matvec(c), b, 'cg')
+
+
+def resonance_weights(reference, structures, method='auto', overlaps=None, regularization=1e-10,
+                      max_condition=1e12, dense_limit=4096, tolerance=1e-10, max_iterations=None,
+                      n_workers=1, processes=False, overlap_path=None):
+    """
+    Weights of the structures (e.g. Kekule structures) in the reference wavefunction (e.g. the Huckel
+    wavefunction of the molecule), from the structure-structure overlap matrix S and the
+    structure-reference overlaps b.
+
+    Methods:
+    - cholesky: solves S c = b by Cholesky factorization; the fast path for well-conditioned S.
+    - eigen: least-squares solution discarding the eigenvalues of S below regularization times the
+      largest one; the fallback for near-singular S, e.g. linearly dependent structures.
+    - cg: conjugate gradient on (S + regularization I) c = b, using S only through matrix-vector
+      products streamed from disk (see overlap_matvec), so that S is never held in memory. Without
+      overlaps, S is computed once with chem_overlap.write_overlap_matrix into overlap_path, or into
+      a temporary file removed afterwards.
+    - auto: cg above dense_limit structures, otherwise cholesky falling back to eigen when S is not
+      positive definite or its condition number exceeds max_condition.
+
+    Args:
+        reference (Wavefunction): The reference wavefunction.
+        structures (list): The K structures.
+        method (str): auto, cholesky, eigen or cg.
+        overlaps (array-like): The K x K overlap matrix if already computed, possibly memory-mapped.
+        regularization (float): The relative eigenvalue cutoff of eigen, and the shift of cg.
+        max_condition (float): The largest condition number accepted by the Cholesky path in auto.
+        dense_limit (int): The number of structures above which auto uses cg.
+        tolerance (float): The relative residual at which cg stops.
+        max_iterations (int): The maximum number of cg iterations, by default K.
+        n_workers (int): The number of workers computing the overlap tiles.
+        processes (bool): Use worker processes instead of threads.
+        overlap_path (str): The .npy file kept with the overlap matrix computed for cg; an interrupted
+            computation resumes from it (see write_overlap_matrix).
+
+    Returns:
+        ResonanceWeights: The coefficients and weights of the structures.
+    """
+    structures = list(structures)
+    b = reference.get_overlaps_wf(structures)
+    if np.isnan(b).any():
+        raise ValueError("the structures must have the size and the number of occupied orbitals of the reference")
+    K = len(structures)
+    if method == 'auto':
+        method = 'cg' if K > dense_limit else 'cholesky'
+    if method == 'cg':
+        if overlaps is not None:
+            return _weights_cg(overlaps, b, regularization, tolerance, max_iterations)
+        with tempfile.TemporaryDirectory() as directory:
+            path = overlap_path or os.path.join(directory, 'overlaps.npy')
+            write_overlap_matrix(structures, path, n_workers=n_workers, processes=processes)
+            # the memory map is released before the temporary directory is removed
+            return _weights_cg(np.load(path, mmap_mode='r'), b, regularization, tolerance, max_iterations)
+
+    S = np.asarray(overlaps) if overlaps is not None else overlap_matrix(structures, n_workers=n_workers, processes=processes)
+    if method == 'cholesky':
+        try:
+            c = _solve_cholesky(S, b, max_condition)
+        except np.linalg.LinAlgError as error:
+            logger.info("Cholesky path failed (%s), using the regularized eigen solver", error)
+            method = 'eigen'
+    if method == 'eigen':
+        c = _solve_eigen(S, b, regularization)
+    elif method != 'cholesky':
+        raise ValueError("unknown method {}".format(method))
+    return ResonanceWeights(c, S @ c, b, method)
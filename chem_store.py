@@ -0,0 +1,222 @@
+import json
+
+import numpy as np
+
+from chem_wavefunction import Wavefunction, iter_wavefunctions_from_xml
+
+try:
+    import scipy.sparse
+except ImportError:
+    scipy = None
+
+# file layout: MAGIC, the header length as a little-endian uint64, the JSON header, then the arrays,
+# each starting on a multiple of ALIGNMENT bytes
+MAGIC = b"HLPYWF01"
+ALIGNMENT = 64
+VERSION = 1
+
+
+class WavefunctionStore:
+    """
+    Read-only set of wavefunctions stored in a binary file written by write_store.
+
+    Opening a store only reads its header: the arrays are memory-mapped and every wavefunction is
+    built on access from zero-copy views of the file. When the file holds the eigen-solutions, the
+    wavefunctions are returned already solved, without diagonalization.
+
+    Wavefunctions can be accessed by index or by name; iterating over the store yields them in file
+    order.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        with open(file_path, 'rb') as f:
+            header = _read_header(f, file_path)
+        self.names = header['names']
+        self.has_solution = header['has_solution']
+        self._index = {name: i for i, name in enumerate(self.names)}
+        data = np.memmap(file_path, dtype=np.uint8, mode='r')
+        self._arrays = {}
+        for key, (offset, dtype, count) in header['arrays'].items():
+            dtype = np.dtype(dtype)
+            self._arrays[key] = data[offset:offset + count * dtype.itemsize].view(dtype)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, key):
+        i = self._index[key] if isinstance(key, str) else range(len(self))[key]
+        return self.get_wavefunction(i)
+
+    def get_names(self):
+        return list(self.names)
+
+    def get_matrix(self, i):
+        """
+        Returns:
+            numpy.ndarray: A read-only view of the matrix of wavefunction i.
+        """
+        n = int(self._arrays['sizes'][i])
+        start = int(self._arrays['matrix_offsets'][i])
+        return self._arrays['matrices'][start:start + n * n].reshape(n, n)
+
+    def get_solution(self, i):
+        """
+        Returns:
+            tuple: Read-only views of the stored eigenvalues and eigenfunctions of wavefunction i, or
+            None if the store holds no solutions.
+        """
+        if not self.has_solution:
+            return None
+        n = int(self._arrays['sizes'][i])
+        start, stop = self._arrays['eigenvalue_offsets'][i:i+2]
+        eigenvalues = self._arrays['eigenvalues'][start:stop]
+        start = int(self._arrays['eigenfunction_offsets'][i])
+        eigenfunctions = self._arrays['eigenfunctions'][start:start + n * len(eigenvalues)].reshape(n, len(eigenvalues))
+        return eigenvalues, eigenfunctions
+
+    def get_wavefunction(self, i, sparse=False):
+        """
+        Builds wavefunction i. Its matrix and stored solution are views of the file, copied only when
+        the wavefunction is modified.
+
+        Args:
+            i (int): The index of the wavefunction.
+            sparse (bool): Build a sparse mode wavefunction; the stored solution is then not used.
+
+        Returns:
+            Wavefunction: The wavefunction.
+        """
+        start, stop = self._arrays['occupation_offsets'][i:i+2]
+        occupation = self._arrays['occupations'][start:stop].tolist()
+        wf = Wavefunction(self.names[i], self.get_matrix(i), occupation, sparse=sparse)
+        solution = None if sparse else self.get_solution(i)
+        if solution is not None:
+            wf.set_solution(*solution)
+        return wf
+
+
+def _read_header(f, file_path):
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError("{} is not a wavefunction store".format(file_path))
+    length = int(np.frombuffer(f.read(8), dtype='<u8')[0])
+    header = json.loads(f.read(length).decode('utf-8'))
+    if header.get('version') != VERSION:
+        raise ValueError("unsupported wavefunction store version {} in {}".format(header.get('version'), file_path))
+    return header
+
+
+def is_store(file_path):
+    """
+    Returns:
+        bool: True if the file starts like a wavefunction store.
+    """
+    with open(file_path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def _dense(matrix):
+    if scipy is not None and scipy.sparse.issparse(matrix):
+        return matrix.toarray()
+    return np.asarray(matrix, dtype=float)
+
+
+def write_store(wavefunctions, file_path, with_solution=True):
+    """
+    Writes wavefunctions to a binary store that WavefunctionStore memory-maps.
+
+    The names are kept in a JSON header; the matrices, occupations and, with with_solution, the
+    eigenvalues and eigenfunctions are concatenated into contiguous float64 arrays, with int64 offset
+    arrays locating each wavefunction in them. Missing solutions are computed before writing.
+
+    Args:
+        wavefunctions (iterable): The wavefunctions to store.
+        file_path (str): The path of the store.
+        with_solution (bool): Also store the eigenvalues and eigenfunctions.
+
+    Returns:
+        int: The number of wavefunctions written.
+    """
+    wavefunctions = list(wavefunctions)
+    sizes = np.array([wf.get_size() for wf in wavefunctions], dtype=np.int64)
+    n_occupations = np.array([len(wf.get_occupation()) for wf in wavefunctions], dtype=np.int64)
+    n_eigenvalues = np.array([len(wf.get_eigenvalues()) if with_solution and wf.get_size() else 0
+                              for wf in wavefunctions], dtype=np.int64)
+    arrays = {
+        'sizes': sizes,
+        'matrix_offsets': np.concatenate(([0], np.cumsum(sizes**2))),
+        'occupation_offsets': np.concatenate(([0], np.cumsum(n_occupations))),
+    }
+    if with_solution:
+        arrays['eigenvalue_offsets'] = np.concatenate(([0], np.cumsum(n_eigenvalues)))
+        arrays['eigenfunction_offsets'] = np.concatenate(([0], np.cumsum(sizes * n_eigenvalues)))
+    # the large arrays are written one wavefunction at a time
+    streamed = {
+        'matrices': (int(arrays['matrix_offsets'][-1]), lambda wf: _dense(wf.get_matrix())),
+        'occupations': (int(arrays['occupation_offsets'][-1]), lambda wf: wf.get_occupation()),
+    }
+    if with_solution:
+        streamed['eigenvalues'] = (int(arrays['eigenvalue_offsets'][-1]),
+                                   lambda wf: wf.get_eigenvalues() if wf.get_size() else [])
+        streamed['eigenfunctions'] = (int(arrays['eigenfunction_offsets'][-1]),
+                                      lambda wf: wf.get_eigenfunctions() if wf.get_size() else [])
+
+    # lay the arrays out after the header, which holds their offsets: grow the room left for it until
+    # it fits
+    layout = {}
+    header = {'version': VERSION, 'has_solution': with_solution,
+              'names': [wf.get_name() for wf in wavefunctions], 'arrays': layout}
+    entries = [(key, '<i8', len(value)) for key, value in arrays.items()] + \
+              [(key, '<f8', count) for key, (count, _) in streamed.items()]
+    header_end = len(MAGIC) + 8
+    while True:
+        offset = _align(header_end)
+        for key, dtype, count in entries:
+            layout[key] = [offset, dtype, count]
+            offset = _align(offset + 8 * count)
+        encoded = json.dumps(header).encode('utf-8')
+        if len(MAGIC) + 8 + len(encoded) <= _align(header_end):
+            break
+        header_end = len(MAGIC) + 8 + len(encoded)
+
+    with open(file_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(np.array([len(encoded)], dtype='<u8').tobytes())
+        f.write(encoded)
+        for key, dtype, count in entries:
+            f.write(b'\0' * (layout[key][0] - f.tell()))
+            if key in arrays:
+                f.write(np.ascontiguousarray(arrays[key], dtype=dtype).tobytes())
+            else:
+                for wf in wavefunctions:
+                    f.write(np.ascontiguousarray(streamed[key][1](wf), dtype=dtype).tobytes())
+        f.write(b'\0' * (offset - f.tell()))
+    return len(wavefunctions)
+
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def read_wavefunctions(file_path, progress=None, sparse=False):
+    """
+    Reads wavefunctions from a binary store or from an XML decomposition file.
+
+    Args:
+        file_path (str): The path to the store or to the XML file.
+        progress (callable): Called as progress(count, name) after each XML wavefunction is read.
+        sparse (bool): Build sparse mode wavefunctions.
+
+    Returns:
+        list: The wavefunctions, or a WavefunctionStore building them on access.
+    """
+    if is_store(file_path):
+        store = WavefunctionStore(file_path)
+        if sparse:
+            return [store.get_wavefunction(i, sparse=True) for i in range(len(store))]
+        return store
+    return list(iter_wavefunctions_from_xml(file_path, progress, sparse))
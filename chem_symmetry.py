@@ -0,0 +1,386 @@
+import hashlib
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# largest work of one search for automorphisms or isomorphisms, as the number of centres refined summed
+# over its refinements; graphs with many interchangeable parts (e.g. disconnected or matching-type
+# ones) exceed it and are treated as having no (found) symmetry, plain diagonalization being faster
+# for them anyway
+SEARCH_BUDGET = 200000
+
+
+class SearchBudgetExceeded(Exception):
+    """
+    Raised by the individualization-refinement search once it has spent its budget.
+    """
+
+
+class _Budget:
+
+    def __init__(self, work):
+        self.remaining = work
+
+    def spend(self, work):
+        self.remaining -= work
+        if self.remaining < 0:
+            raise SearchBudgetExceeded()
+
+class _Graph:
+    """
+    Weighted graph of a symmetric matrix: the off-diagonal non-zero elements are the edges and the
+    diagonal elements colour the vertices.
+    """
+
+    def __init__(self, matrix):
+        self.matrix = np.asarray(matrix, dtype=float)
+        self.size = len(self.matrix)
+        off_diagonal = self.matrix - np.diag(np.diag(self.matrix))
+        self.rows, self.cols = np.nonzero(off_diagonal)
+        self.weights, weight_ids = np.unique(off_diagonal[self.rows, self.cols], return_inverse=True)
+        self.weight_ids = weight_ids.astype(np.uint64).ravel()
+        # random odd 64-bit words hashing the colours, fixed so that the refined colours are canonical
+        self.words = np.random.default_rng(self.size).integers(0, 2**63, size=(2, self.size + 1), dtype=np.uint64) | np.uint64(1)
+        self.diagonal_values, diagonal_ids = np.unique(np.diag(self.matrix), return_inverse=True)
+        self.colours, self.signatures = _refine(self, diagonal_ids.ravel(), signatures=True)
+
+    def invariant(self):
+        """
+        Returns:
+            str: A hash of the size, the diagonal and bond values and the refined colour classes of the
+            graph, equal for isomorphic graphs.
+        """
+        digest = hashlib.blake2b(digest_size=20)
+        for array in (np.array([self.size, len(self.rows)]), self.diagonal_values, self.weights,
+                      np.sort(self.signatures[self.colours])):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        return digest.hexdigest()
+
+    def is_automorphism(self, sigma):
+        return self.is_isomorphism(self, sigma)
+
+    def is_isomorphism(self, other, sigma):
+        # sigma maps the graph onto other: other[sigma[i], sigma[j]] = self[i, j]
+        return len(self.rows) == len(other.rows) \
+            and np.array_equal(other.matrix[sigma[self.rows], sigma[self.cols]], self.matrix[self.rows, self.cols]) \
+            and np.array_equal(np.diag(other.matrix)[sigma], np.diag(self.matrix))
+
+
+def _refine(graph, colours, signatures=False):
+    """
+    Colour refinement (1-dimensional Weisfeiler-Lehman): vertices are split by the multiset of the
+    (weight, colour) pairs of their neighbours until the partition is stable.
+
+    The new colours only depend on the hashed invariants, so two isomorphic coloured graphs are refined
+    to colourings related by the isomorphism. With signatures, the hashes of the stable colours are
+    returned as well.
+    """
+    colours = np.asarray(colours, dtype=np.int64)
+    n_colours = colours.max() + 1 if len(colours) else 0
+    words = graph.words
+    with np.errstate(over='ignore'):
+        while True:
+            keys = words[0][colours[graph.cols]] * (np.uint64(2) * graph.weight_ids + np.uint64(1))
+            sums = np.zeros(graph.size, dtype=np.uint64)
+            np.add.at(sums, graph.rows, keys)
+            hashes = words[1][colours] * np.uint64(0x9E3779B97F4A7C15) + sums
+            labels, colours = np.unique(hashes, return_inverse=True)
+            colours = colours.ravel()
+            if len(labels) == n_colours:
+                return (colours, labels) if signatures else colours
+            n_colours = len(labels)
+
+
+def _individualize(graph, colours, vertex, budget=None):
+    if budget is not None:
+        budget.spend(graph.size)
+    colours = colours.copy()
+    colours[vertex] = colours.max() + 1
+    return _refine(graph, colours)
+
+
+def _compatible(colours_a, colours_b):
+    return np.array_equal(np.bincount(colours_a), np.bincount(colours_b))
+
+
+def _target_cell(colours):
+    # the first smallest non-trivial cell
+    counts = np.bincount(colours)
+    counts[counts < 2] = len(colours) + 1
+    return np.argmin(counts)
+
+
+def _leaf(graph, other, colours_a, colours_b):
+    # the permutation matching two discrete colourings, if it is an isomorphism
+    sigma = np.empty(graph.size, dtype=int)
+    sigma[np.argsort(colours_a)] = np.argsort(colours_b)
+    return sigma if graph.is_isomorphism(other, sigma) else None
+
+
+def _branches(graph, other, colours_a, colours_b, budget):
+    """
+    Yields the compatible pairs of colourings below a node of the search: a vertex of the target cell
+    individualized in colours_a, and each vertex of the same cell in colours_b.
+    """
+    cell = _target_cell(colours_a)
+    vertex = np.flatnonzero(colours_a == cell)[0]
+    individualized_a = _individualize(graph, colours_a, vertex, budget)
+    for image in np.flatnonzero(colours_b == cell):
+        individualized_b = _individualize(other, colours_b, image, budget)
+        if _compatible(individualized_a, individualized_b):
+            yield individualized_a, individualized_b
+
+
+def _match(graph, colours_a, colours_b, explore, other=None, budget=None):
+    """
+    Automorphisms mapping the coloured graph colours_a onto colours_b, found by individualization and
+    refinement; or, when other is given, isomorphisms from graph coloured by colours_a onto other
+    coloured by colours_b.
+
+    Every branch of the first search level is tried when explore is set, deeper levels stop at their
+    first automorphism. The search is depth-first over an explicit stack of branch generators, so its
+    depth is not bounded by the recursion limit.
+
+    Raises:
+        SearchBudgetExceeded: Once the search has spent budget (SEARCH_BUDGET by default).
+
+    Yields:
+        numpy.ndarray: The automorphisms, as permutations sigma mapping vertex i to sigma[i].
+    """
+    other = graph if other is None else other
+    budget = _Budget(SEARCH_BUDGET) if budget is None else budget
+    if colours_a.max() + 1 == graph.size:
+        sigma = _leaf(graph, other, colours_a, colours_b)
+        if sigma is not None:
+            yield sigma
+        return
+    stack = [_branches(graph, other, colours_a, colours_b, budget)]
+    while stack:
+        pair = next(stack[-1], None)
+        if pair is None:
+            stack.pop()
+            continue
+        individualized_a, individualized_b = pair
+        if individualized_a.max() + 1 < graph.size:
+            stack.append(_branches(graph, other, individualized_a, individualized_b, budget))
+            continue
+        sigma = _leaf(graph, other, individualized_a, individualized_b)
+        if sigma is None:
+            continue
+        yield sigma
+        if not explore:
+            return
+        # back to the next branch of the first level
+        del stack[1:]
+
+
+def _orbits(sigma):
+    """
+    Returns:
+        list: The cycles of the permutation sigma, each starting with its smallest vertex.
+    """
+    seen = np.zeros(len(sigma), dtype=bool)
+    orbits = []
+    for start in range(len(sigma)):
+        if seen[start]:
+            continue
+        orbit = [start]
+        seen[start] = True
+        vertex = sigma[start]
+        while vertex != start:
+            orbit.append(vertex)
+            seen[vertex] = True
+            vertex = sigma[vertex]
+        orbits.append(np.array(orbit, dtype=int))
+    return orbits
+
+
+def order(sigma):
+    """
+    Returns:
+        int: The order of the permutation sigma, i.e. the least common multiple of its cycle lengths.
+    """
+    return int(np.lcm.reduce([len(orbit) for orbit in _orbits(sigma)])) if len(sigma) else 1
+
+
+def find_automorphism(matrix):
+    """
+    Searches a symmetry of the Huckel graph: a permutation sigma of the centres that leaves the matrix
+    unchanged, H[sigma[i], sigma[j]] = H[i, j].
+
+    Colour refinement gives the cells of centres that may be equivalent. A vertex of the largest cell is
+    mapped to the other vertices of its cell in turn and the search keeps the automorphism of highest
+    order, which generates the largest cyclic subgroup and therefore the smallest blocks. The search
+    stops once the cyclic group of the best automorphism maps the vertex onto its whole cell, or once
+    it has spent SEARCH_BUDGET, returning the best automorphism found so far.
+
+    Args:
+        matrix (numpy.ndarray): A symmetric matrix.
+
+    Returns:
+        numpy.ndarray: The automorphism, or None if only the identity was found.
+    """
+    graph = _Graph(matrix)
+    if graph.size == 0:
+        return None
+    counts = np.bincount(graph.colours)
+    cell = np.argmax(counts)
+    if counts[cell] < 2:
+        return None
+    members = np.flatnonzero(graph.colours == cell)
+    vertex = members[0]
+    budget = _Budget(SEARCH_BUDGET)
+    best, best_order = None, 1
+    reached = {vertex}
+    try:
+        individualized = _individualize(graph, graph.colours, vertex, budget)
+        for image in members[1:]:
+            if image in reached:
+                continue
+            individualized_image = _individualize(graph, graph.colours, image, budget)
+            if not _compatible(individualized, individualized_image):
+                continue
+            for sigma in _match(graph, individualized, individualized_image, True, budget=budget):
+                orbit = next(orbit for orbit in _orbits(sigma) if vertex in orbit)
+                reached.update(orbit.tolist())
+                sigma_order = order(sigma)
+                if sigma_order > best_order:
+                    best, best_order, best_orbit = sigma, sigma_order, orbit
+            if best is not None and len(best_orbit) == len(members):
+                break
+    except SearchBudgetExceeded:
+        logger.info("Automorphism search of a %d-centre graph stopped at its budget", graph.size)
+    return best
+
+
+def group_isomorphic(matrices):
+    """
+    Groups symmetric matrices that are equal up to a relabelling of their rows and columns, e.g. the
+    Huckel matrices of structures related by a symmetry of the molecule.
+
+    Matrices are first bucketed by their colour refinement invariant (see _Graph.invariant), then each
+    one is matched by individualization and refinement against the representatives of its bucket. A
+    match that exceeds SEARCH_BUDGET is given up, so that such a matrix may start a class
+    of its own although it is equivalent to another one.
+
+    Args:
+        matrices (list): The symmetric matrices.
+
+    Returns:
+        list: The classes, as lists of (index, sigma) pairs with sigma the permutation mapping the first
+        matrix of the class onto matrix index, M_index[sigma[i], sigma[j]] = M_first[i, j]; the first
+        pair of each class is its representative, with the identity.
+    """
+    buckets = {}
+    classes = []
+    for index, matrix in enumerate(matrices):
+        graph = _Graph(matrix)
+        representatives = buckets.setdefault(graph.invariant(), [])
+        for representative, members in representatives:
+            try:
+                sigma = next(_match(representative, representative.colours, graph.colours, False, graph), None) \
+                    if graph.size else np.zeros(0, dtype=int)
+            except SearchBudgetExceeded:
+                logger.info("Isomorphism search of a %d-centre graph stopped at its budget", graph.size)
+                sigma = None
+            if sigma is not None:
+                members.append((index, sigma))
+                break
+        else:
+            members = [(index, np.arange(graph.size))]
+            representatives.append((graph, members))
+            classes.append(members)
+    return classes
+
+
+def symmetry_label(k, m):
+    """
+    Returns:
+        str: The label of the irreducible representation k of the cyclic group of order m: A for the
+        totally symmetric one, B for the one antisymmetric under the generator and Ek for the
+        (complex conjugate) pairs k and m - k.
+    """
+    if k == 0:
+        return "A"
+    if 2 * k == m:
+        return "B"
+    return "E%d" % min(k, m - k)
+
+
+def symmetry_adapted_eigh(matrix, sigma=None):
+    """
+    Diagonalizes a symmetric matrix in the basis adapted to the cyclic group generated by one of its
+    automorphisms.
+
+    With orbits a of sigma of length L_a and representatives r_a, the basis function of orbit a in the
+    irreducible representation k (defined when k L_a is a multiple of the group order m) is
+    sum_t w^(-k t) e_(sigma^t r_a) / sqrt(L_a), with w = exp(2 i pi / m). The matrix is block
+    diagonal in this basis, with blocks
+        H_k[a, b] = sqrt(L_a / L_b) sum_u w^(-k u) H[r_a, sigma^u r_b].
+    Only the blocks k <= m/2 are diagonalized: the block m - k is the complex conjugate of the block k,
+    and each of its complex eigenvectors psi yields the real degenerate pair sqrt(2) Re psi,
+    sqrt(2) Im psi, both labelled Ek.
+
+    Args:
+        matrix (numpy.ndarray): A symmetric matrix.
+        sigma (numpy.ndarray): An automorphism of the matrix; one is searched when not given.
+
+    Returns:
+        tuple: The eigenvalues and eigenfunctions, in no particular order, and the list of the
+        symmetry labels of the eigenfunctions.
+    """
+    matrix = np.asarray(matrix, dtype=float)
+    n = len(matrix)
+    if sigma is None:
+        sigma = find_automorphism(matrix)
+    if sigma is None:
+        eigenvalues, eigenfunctions = np.linalg.eigh(matrix)
+        return eigenvalues, eigenfunctions, ["A"] * n
+
+    orbits = _orbits(sigma)
+    lengths = np.array([len(orbit) for orbit in orbits])
+    m = int(np.lcm.reduce(lengths))
+    # the centres grouped by orbit, with their orbit and their position u within it
+    centres = np.concatenate(orbits)
+    orbit_of = np.repeat(np.arange(len(orbits)), lengths)
+    position = np.concatenate([np.arange(length) for length in lengths])
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    rows = matrix[centres[starts]][:, centres]
+
+    eigenvalues = np.empty(n)
+    eigenfunctions = np.zeros((n, n))
+    labels = [None] * n
+    column = 0
+    for k in range(m // 2 + 1):
+        valid = (k * lengths) % m == 0
+        if not valid.any():
+            continue
+        selected = valid[orbit_of]
+        phases = np.exp(-2j * np.pi * k * position[selected] / m)
+        block = np.add.reduceat(rows[valid][:, selected] * phases, np.flatnonzero(np.diff(np.concatenate(([-1], orbit_of[selected])))), axis=1)
+        scale = np.sqrt(lengths[valid])
+        block *= scale[:, None] / scale[None, :]
+        real = k == 0 or 2 * k == m
+        if real:
+            block_eigenvalues, block_eigenfunctions = np.linalg.eigh(block.real)
+        else:
+            block_eigenvalues, block_eigenfunctions = np.linalg.eigh((block + block.conj().T) / 2)
+        # back to the centres: component phase / sqrt(L_a) on the centre at position u of orbit a
+        local = np.cumsum(valid) - 1
+        psi = block_eigenfunctions[local[orbit_of[selected]]] * (phases / np.sqrt(lengths[orbit_of[selected]]))[:, None]
+        size = len(block_eigenvalues)
+        if real:
+            eigenvalues[column:column+size] = block_eigenvalues
+            eigenfunctions[centres[selected], column:column+size] = psi.real
+            labels[column:column+size] = [symmetry_label(k, m)] * size
+            column += size
+        else:
+            eigenvalues[column:column+2*size:2] = block_eigenvalues
+            eigenvalues[column+1:column+2*size:2] = block_eigenvalues
+            eigenfunctions[centres[selected], column:column+2*size:2] = np.sqrt(2) * psi.real
+            eigenfunctions[centres[selected], column+1:column+2*size:2] = np.sqrt(2) * psi.imag
+            labels[column:column+2*size] = [symmetry_label(k, m)] * (2 * size)
+            column += 2 * size
+    return eigenvalues, eigenfunctions, labels
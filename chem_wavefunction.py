@@ -1,33 +1,533 @@
+import logging
+
 import numpy as np
 import xml.etree.ElementTree as ET
 
+import chem_cache
+from chem_overlap import gather_overlap, log_overlap_row
+from chem_symmetry import find_automorphism, group_isomorphic, symmetry_adapted_eigh
+
+try:
+    import scipy.sparse
+    import scipy.sparse.linalg
+except ImportError:
+    # only needed by the sparse mode of Wavefunction
+    scipy = None
+
+logger = logging.getLogger(__name__)
+
 #class wavefunction
 class Wavefunction:
-    def __init__(self, name, matrix, occupation):
+    """
+    Huckel wavefunction built from a connectivity matrix and an orbital occupation.
+
+    The eigen-solution is computed lazily: set_matrix and set_occupation only mark it as stale,
+    and the matrix is diagonalized the first time eigenvalues, eigenfunctions or the Huckel
+    energy are requested. n_diagonalizations counts the diagonalizations actually performed and
+    n_skipped_diagonalizations those avoided because nothing read the result in between.
+
+    A centre appended with add_centre extends an up-to-date solution in O(n^2); other edits, such as a
+    bond set with set_element, are solved again, only the edited component being diagonalized (see
+    below).
+
+    Matrices of matching type, made of isolated two-centre bonds and lone centres like the Kekule and
+    Lewis structures of a decomposition, are solved in closed form without diagonalization; their
+    orbitals are kept as two-centre supports (get_orbital_support) so that overlaps with them reduce
+    to gathers of rows.
+
+    The dense solver diagonalizes each connected component of the matrix on its own, through the
+    content-addressed eigen_cache (see chem_cache.EigenCache): an edit only re-solves the component it
+    touches, identical components (e.g. the isolated double bonds of a Kekule structure) are solved
+    once, and a matrix seen before, in this run or, with an on-disk cache, in an earlier one, is not
+    diagonalized again. Setting eigen_cache to None disables the cache.
+
+    With set_electron_count, the occupation is not given but built by aufbau_occupation from the
+    eigenvalues of each new solution, degenerate open shells being filled fractionally.
+
+    A wavefunction linked to an equivalent one by set_equivalent, i.e. whose matrix is the same up to
+    a relabelling of the centres, takes its solution from it by permuting the rows of the
+    eigenfunctions instead of diagonalizing (see group_equivalent_wavefunctions);
+    n_equivalent_solutions counts these.
+
+    In symmetry mode (symmetry=True) the solver searches an automorphism of the Huckel graph and
+    diagonalizes the blocks of the symmetry-adapted basis of the cyclic group it generates (see
+    chem_symmetry.symmetry_adapted_eigh). The automorphism is kept until the matrix changes, so
+    solving an unchanged matrix again does not search it again. get_symmetry_labels then gives the
+    irreducible representation of each orbital; the two orbitals of a degenerate E pair are adjacent.
+
+    In sparse mode (sparse=True, requires scipy) the matrix is stored as a scipy.sparse CSR matrix and
+    only the leading orbitals are computed with the Lanczos method: the occupied ones and n_virtual
+    orbitals above them. Eigenvalues and eigenfunctions then cover these orbitals only, which is all
+    the occupation, the Huckel energy and the overlaps need.
+    """
+
+    # diagonalize the connected components of the matrix separately
+    block_diagonalization = True
+    # solve matrices of matching type in closed form
+    analytic_matching = True
+    # cache of the eigen-decompositions of the dense solver, shared by all the wavefunctions
+    eigen_cache = chem_cache.default_cache
+    # largest sum of the pi bond orders of a centre, the reference of the free valences
+    max_bond_order_sum = np.sqrt(3)
+
+    def __init__(self, name, matrix, occupation, sparse=False, n_virtual=1, symmetry=False):
+        if sparse and scipy is None:
+            raise ImportError("the sparse mode of Wavefunction requires scipy")
+        if sparse and symmetry:
+            raise ValueError("the symmetry mode of Wavefunction requires a dense matrix")
         self.name = name
-        self.matrix = matrix
+        self.sparse = sparse
+        self.symmetry = symmetry
+        self.n_virtual = n_virtual
+        self.matrix = self._as_sparse(matrix) if sparse else matrix
         self.occupation = occupation
-        self.update()
+        # number of electrons placed by aufbau_occupation, or None for an explicit occupation
+        self.n_electrons = None
+        self.n_diagonalizations = 0
+        self.n_skipped_diagonalizations = 0
+        self.n_equivalent_solutions = 0
+        self._eigenvalues = None
+        self._eigenfunctions = None
+        self._huckel_energy = None
+        self._stale = True
+        self._energy_stale = True
+        # the solution is complete and matches the matrix, so that add_centre can extend it
+        self._extendable = False
+        # irreducible representations of the orbitals in symmetry mode
+        self._symmetry_labels = None
+        # (matrix key, sigma) of the last automorphism search in symmetry mode
+        self._automorphism = None
+        # (eigenfunctions, occupation, block) of the last occupied block built
+        self._occupied_block = None
+        # (eigenfunctions, occupation, density matrix) and (eigenfunctions, occupation, properties) of
+        # the last density matrix and pi properties built
+        self._density_matrix = None
+        self._pi_properties = None
+        # (eigenfunctions, support) of the last closed-form solution of a matching-type matrix
+        self._orbital_support = None
+        # (representative, sigma) of an equivalent wavefunction the solution is derived from
+        self._equivalent = None
     
     def huckel(self):
-        if self.matrix == None or len(self.matrix) == 0:
+        if self.get_size() == 0:
             return None, None, None
-        # get eigenfunctions and eigenvalues from matrix using numpy
-        eigenvalues, eigenfunctions = np.linalg.eigh(self.matrix)
+        labels = None
+        support = None
+        if self.sparse:
+            eigenvalues, eigenfunctions = self._sparse_eigh()
+        elif self.symmetry:
+            eigenvalues, eigenfunctions, labels = symmetry_adapted_eigh(self.matrix, self._get_automorphism())
+        else:
+            matching = self._matching_eigh() if self.analytic_matching else None
+            if matching is not None:
+                eigenvalues, support = matching[0], matching[1:]
+                eigenfunctions = None
+            elif self.block_diagonalization:
+                eigenvalues, eigenfunctions = self._block_eigh()
+            else:
+                # get eigenfunctions and eigenvalues from matrix using numpy
+                eigenvalues, eigenfunctions = self._eigh(np.asarray(self.matrix, dtype=float))
 
         # order eigenvalues and eigenfunctions by descending eigenvalues
         idx = eigenvalues.argsort()[::-1]
         eigenvalues = eigenvalues[idx]
-        eigenfunctions = eigenfunctions[:,idx]
+        if support is not None:
+            support = tuple(array[idx] for array in support)
+            eigenfunctions = _support_to_dense(len(eigenvalues), support)
+            self._orbital_support = (eigenfunctions, support)
+        else:
+            eigenfunctions = eigenfunctions[:,idx]
+        if labels is not None:
+            self._symmetry_labels = [labels[i] for i in idx]
+
+        return eigenvalues, eigenfunctions, self.compute_huckel_energy(eigenvalues)
+
+    def compute_huckel_energy(self, eigenvalues):
+        if eigenvalues is None:
+            return None
+        if self.n_electrons is not None:
+            # the occupation follows the orbitals of every new solution
+            self.occupation = aufbau_occupation(eigenvalues, self.n_electrons).tolist()
+        occupation = np.asarray(self.occupation, dtype=float)
+        m = min(len(occupation), len(eigenvalues))
+        return float(occupation[:m] @ eigenvalues[:m])
+
+    def _matching_eigh(self):
+        """
+        Closed-form eigen-solution of a matrix of matching type, in which every centre is either lone or
+        bonded to exactly one other centre, in O(n) once the non-zero elements are known.
 
-        # compute Huckel energy
-        huckel_energy = 0
-        for i in range(len(self.occupation)):
-            huckel_energy += self.occupation[i]*eigenvalues[i]
-        return eigenvalues, eigenfunctions, huckel_energy
+        A bond (i, j) with diagonal elements a, b and bond element c gives the orbitals m + r along
+        (cos t, sin t) and m - r along (-sin t, cos t) on (i, j), with m = (a + b)/2,
+        r = sqrt(((a - b)/2)^2 + c^2) and t = atan2(c, (a - b)/2)/2. A lone centre i gives the
+        orbital a along e_i.
+
+        Returns:
+            tuple: The eigenvalues, in no particular order, and the support of the orbitals: their two
+            centres (the same one twice for a lone centre) and the two coefficients on them. None if
+            the matrix is not of matching type.
+        """
+        matrix = np.asarray(self.matrix, dtype=float)
+        n = len(matrix)
+        rows, cols = np.nonzero(matrix)
+        bonded = rows != cols
+        rows, cols = rows[bonded], cols[bonded]
+        if np.any(np.bincount(rows, minlength=n) > 1):
+            return None
+        partner = np.full(n, -1)
+        partner[rows] = cols
+        diagonal = np.diag(matrix)
+        first = np.flatnonzero(partner > np.arange(n))
+        second = partner[first]
+        lone = np.flatnonzero(partner < 0)
+        a, b, c = diagonal[first], diagonal[second], matrix[first, second]
+        half_gap = (a - b) / 2
+        r = np.hypot(half_gap, c)
+        t = np.arctan2(c, half_gap) / 2
+        eigenvalues = np.concatenate(((a + b) / 2 + r, (a + b) / 2 - r, diagonal[lone]))
+        centres = np.concatenate((first, first, lone))
+        partners = np.concatenate((second, second, lone))
+        coefficients = np.concatenate((np.cos(t), -np.sin(t), np.ones(len(lone))))
+        partner_coefficients = np.concatenate((np.sin(t), np.cos(t), np.zeros(len(lone))))
+        return eigenvalues, centres, partners, coefficients, partner_coefficients
+
+    def _block_eigh(self):
+        """
+        Diagonalizes the connected components of the matrix separately and merges the results.
+
+        The eigenpairs of each component are looked up in the eigen cache by the content of its
+        block, so unchanged and identical components are not diagonalized again.
+
+        Returns:
+            tuple: The eigenvalues and eigenfunctions, in no particular order.
+        """
+        matrix = np.asarray(self.matrix, dtype=float)
+        n = len(matrix)
+        components = _connected_components(matrix)
+        if len(components) == 1:
+            return self._eigh(matrix)
+        eigenvalues = np.empty(n)
+        eigenfunctions = np.zeros((n, n))
+        start = 0
+        for indices in components:
+            block_eigenvalues, block_eigenfunctions = self._eigh(matrix[np.ix_(indices, indices)])
+            stop = start + len(indices)
+            eigenvalues[start:stop] = block_eigenvalues
+            eigenfunctions[indices, start:stop] = block_eigenfunctions
+            start = stop
+        return eigenvalues, eigenfunctions
+
+    def _eigh(self, matrix):
+        # the cached arrays are read-only: callers index them into new arrays
+        if self.eigen_cache is None:
+            return np.linalg.eigh(matrix)
+        return self.eigen_cache.eigh(matrix)
+
+    def _sparse_eigh(self):
+        """
+        Leading eigenpairs of the sparse matrix, computed with the Lanczos method (ARPACK).
+
+        Returns:
+            tuple: The eigenvalues and eigenfunctions of the occupied orbitals and of the n_virtual
+            orbitals above them, in no particular order.
+        """
+        n = self.get_size()
+        n_orbitals = max(min(self.get_number_of_occupied_orbitals() + self.n_virtual, n), 1)
+        if n_orbitals >= n - 1:
+            # ARPACK needs fewer orbitals than n - 1, small problems are solved densely
+            eigenvalues, eigenfunctions = np.linalg.eigh(self.matrix.toarray())
+            return eigenvalues[n - n_orbitals:], eigenfunctions[:, n - n_orbitals:]
+        # a fixed random start vector keeps results reproducible without favouring any symmetry
+        v0 = np.random.default_rng(n).standard_normal(n)
+        if self.matrix.nnz == 0 or not np.any(self.matrix @ v0):
+            # a zero matrix, e.g. unbonded centres, stops ARPACK at its start: its eigenpairs are the
+            # basis vectors
+            leading = np.argsort(self.matrix.diagonal(), kind='stable')[n - n_orbitals:]
+            eigenfunctions = np.zeros((n, n_orbitals))
+            eigenfunctions[leading, np.arange(n_orbitals)] = 1.0
+            return self.matrix.diagonal()[leading], eigenfunctions
+        return scipy.sparse.linalg.eigsh(self.matrix, k=n_orbitals, which='LA', v0=v0)
+
+    @staticmethod
+    def _as_sparse(matrix):
+        if scipy is None:
+            raise ImportError("the sparse mode of Wavefunction requires scipy")
+        if matrix is None:
+            matrix = np.zeros((0, 0))
+        return scipy.sparse.csr_matrix(matrix, dtype=float)
+
+    def get_size(self):
+        """
+        Returns:
+            int: The number of centres, i.e. the dimension of the matrix.
+        """
+        if self.matrix is None:
+            return 0
+        return np.shape(self.matrix)[0]
+
+    def get_orbital_support(self):
+        """
+        Returns:
+            tuple: For a wavefunction solved in closed form as a matching (see _matching_eigh), the
+            arrays (centres, partners, coefficients, partner_coefficients) describing each orbital, in
+            the order of the eigenvalues, as coefficient e_centre + partner_coefficient e_partner.
+            None for other wavefunctions.
+        """
+        eigenfunctions = self.eigenfunctions
+        if self._orbital_support is not None and self._orbital_support[0] is eigenfunctions:
+            return self._orbital_support[1]
+        return None
+
+    def get_occupied_support(self):
+        """
+        Returns:
+            tuple: The orbital support (see get_orbital_support) of the occupied orbitals only, or None.
+        """
+        support = self.get_orbital_support()
+        if support is None:
+            return None
+        occupied = self._occupied_columns(len(support[0]))
+        return tuple(array[occupied] for array in support)
+
+    def _get_automorphism(self):
+        # the automorphism search costs more than the blocks it gives: it is only run again when the
+        # matrix itself changed, not on each solve
+        key = chem_cache.matrix_key(self.matrix)
+        if self._automorphism is None or self._automorphism[0] != key:
+            self._automorphism = (key, find_automorphism(self.matrix))
+        sigma = self._automorphism[1]
+        # without a symmetry the identity keeps symmetry_adapted_eigh from searching again
+        return sigma if sigma is not None else np.arange(self.get_size())
+
+    def get_symmetry_labels(self):
+        """
+        Returns:
+            list: The symmetry labels of the orbitals, in the order of the eigenvalues (A, B, E1, ...,
+            see chem_symmetry.symmetry_label), or None outside symmetry mode.
+        """
+        if not self.symmetry:
+            return None
+        self._ensure_solved()
+        return self._symmetry_labels
+
+    def get_number_of_occupied_orbitals(self):
+        """
+        Returns:
+            int: The number of orbitals up to the last one with a non-zero occupation; with an
+            electron count, the number of orbitals it fills by pairs.
+        """
+        if self.n_electrons is not None:
+            return -(-int(np.ceil(self.n_electrons)) // 2)
+        occupied = np.flatnonzero(np.asarray(self.occupation))
+        return occupied[-1] + 1 if len(occupied) else 0
+
+    def get_frontier_orbitals(self, n_orbitals=2, sigma=0.0):
+        """
+        Returns the orbitals whose eigenvalues are closest to sigma, e.g. the HOMO and the LUMO.
+
+        In sparse mode they are computed with shift-invert Lanczos, independently of the stored
+        solution; sigma must not be an eigenvalue of the matrix.
+
+        Args:
+            n_orbitals (int): The number of orbitals to return.
+            sigma (float): The energy around which the orbitals are searched.
+
+        Returns:
+            tuple: The eigenvalues, in descending order, and the corresponding eigenfunctions.
+        """
+        n = self.get_size()
+        n_orbitals = min(n_orbitals, n)
+        if self.sparse and n_orbitals < n - 1:
+            v0 = np.random.default_rng(n).standard_normal(n)
+            eigenvalues, eigenfunctions = scipy.sparse.linalg.eigsh(self.matrix.tocsc(), k=n_orbitals, sigma=sigma, which='LM', v0=v0)
+        elif self.sparse:
+            eigenvalues, eigenfunctions = np.linalg.eigh(self.matrix.toarray())
+        else:
+            eigenvalues, eigenfunctions = self.eigenvalues, self.eigenfunctions
+        nearest = np.argsort(np.abs(eigenvalues - sigma), kind='stable')[:n_orbitals]
+        idx = nearest[eigenvalues[nearest].argsort()[::-1]]
+        return eigenvalues[idx], eigenfunctions[:, idx]
     
     def update(self):
-        self.eigenvalues, self.eigenfunctions, self.huckel_energy = self.huckel()
+        """
+        Diagonalizes the matrix immediately, whether or not the current solution is stale.
+        """
+        if self._equivalent is not None and self._solve_from_equivalent():
+            return
+        self._eigenvalues, self._eigenfunctions, self._huckel_energy = self.huckel()
+        self.n_diagonalizations += 1
+        self._stale = False
+        self._energy_stale = False
+        # extending needs the full eigenbasis, which the sparse mode does not compute, and would mix
+        # the symmetry labels
+        self._extendable = self._eigenvalues is not None and not (self.sparse or self.symmetry)
+
+    def set_equivalent(self, representative, sigma):
+        """
+        Declares the matrix equal to the one of representative up to the relabelling sigma of the
+        centres, H[sigma[i], sigma[j]] = H_representative[i, j], so that the solution is derived from
+        the representative's when it is next needed. The relation is checked then, in O(n^2), and the
+        matrix is diagonalized as usual if either matrix has changed.
+
+        Args:
+            representative (Wavefunction): The equivalent wavefunction, with the same occupation.
+            sigma (numpy.ndarray): The permutation of the centres.
+        """
+        if self.sparse or representative.sparse:
+            raise ValueError("equivalent wavefunctions must have dense matrices")
+        self._equivalent = (representative, np.asarray(sigma, dtype=int))
+
+    def _solve_from_equivalent(self):
+        """
+        Derives the solution from the representative set by set_equivalent: the orbital i of the
+        representative, with coefficient c on centre k, has coefficient c on centre sigma[k] here.
+
+        Returns:
+            bool: True if the matrices are still related by sigma and the solution was stored.
+        """
+        representative, sigma = self._equivalent
+        if representative is self or representative.get_size() != len(sigma) or self.get_size() != len(sigma) \
+                or not np.array_equal(np.asarray(self.matrix)[np.ix_(sigma, sigma)], np.asarray(representative.matrix)):
+            self._equivalent = None
+            return False
+        eigenfunctions = np.empty_like(representative.eigenfunctions)
+        eigenfunctions[sigma] = representative.eigenfunctions
+        self._eigenvalues = np.array(representative.eigenvalues)
+        self._eigenfunctions = eigenfunctions
+        support = representative.get_orbital_support()
+        if support is not None:
+            centres, partners, coefficients, partner_coefficients = support
+            self._orbital_support = (eigenfunctions, (sigma[centres], sigma[partners], coefficients, partner_coefficients))
+        if self.symmetry:
+            self._symmetry_labels = representative.get_symmetry_labels() if representative.symmetry else None
+        self._huckel_energy = self.compute_huckel_energy(self._eigenvalues)
+        self._stale = False
+        self._energy_stale = False
+        self._extendable = len(self._eigenvalues) == self.get_size() and not self.symmetry
+        self.n_equivalent_solutions += 1
+        return True
+
+    def set_solution(self, eigenvalues, eigenfunctions):
+        """
+        Installs a previously computed eigen-solution of the current matrix, e.g. read from a store,
+        instead of diagonalizing it. The Huckel energy is computed from it when next read.
+
+        Args:
+            eigenvalues (numpy.ndarray): The eigenvalues, in descending order.
+            eigenfunctions (numpy.ndarray): The corresponding eigenfunctions, as columns.
+        """
+        self._eigenvalues = eigenvalues
+        self._eigenfunctions = eigenfunctions
+        self._stale = False
+        self._energy_stale = True
+        self._symmetry_labels = None
+        complete = len(eigenvalues) == self.get_size()
+        self._extendable = complete and not (self.sparse or self.symmetry)
+
+    def invalidate(self):
+        """
+        Marks the eigen-solution as stale so that it is recomputed when next read.
+        """
+        if self._stale:
+            # the pending diagonalization is superseded before anybody read it
+            self.n_skipped_diagonalizations += 1
+        self._stale = True
+        self._energy_stale = True
+
+    def is_stale(self):
+        return self._stale
+
+    def get_diagonalization_counts(self):
+        """
+        Returns:
+            tuple: The number of diagonalizations performed and the number skipped.
+        """
+        return self.n_diagonalizations, self.n_skipped_diagonalizations
+
+    def set_element(self, i, j, value):
+        """
+        Sets the symmetric matrix elements (i, j) and (j, i), e.g. to add or remove a bond.
+
+        Args:
+            i (int): The row of the element.
+            j (int): The column of the element.
+            value (float): The new value.
+        """
+        if self.sparse:
+            matrix = self.matrix.tolil()
+            if matrix[i, j] == value:
+                return
+            matrix[i, j] = value
+            matrix[j, i] = value
+            self.matrix = matrix.tocsr()
+            self.invalidate()
+            return
+        if not isinstance(self.matrix, np.ndarray) or self.matrix.dtype.kind != 'f' \
+                or not self.matrix.flags.writeable:
+            self.matrix = np.array(self.matrix, dtype=float)
+        if self.matrix[i, j] == value:
+            return
+        self.matrix[i, j] = value
+        self.matrix[j, i] = value
+        self._extendable = False
+        self.invalidate()
+
+    def add_centre(self, alpha=0.0):
+        """
+        Appends an isolated centre with diagonal element alpha to the matrix.
+
+        An existing eigen-solution is extended with the eigenpair (alpha, e_n) in O(n^2) instead
+        of being recomputed.
+
+        Args:
+            alpha (float): The diagonal element of the new centre.
+        """
+        n = self.get_size()
+        if self.sparse:
+            self.matrix = scipy.sparse.block_diag((self.matrix, [[alpha]]), format='csr') if n > 0 \
+                else self._as_sparse([[alpha]])
+            self.invalidate()
+            return
+        matrix = np.zeros((n+1, n+1))
+        if n > 0:
+            matrix[:n, :n] = self.matrix
+        matrix[n, n] = alpha
+        self.matrix = matrix
+        if not self._extendable:
+            self.invalidate()
+            return
+        # keep the descending order of the eigenvalues
+        position = np.searchsorted(-self._eigenvalues, -alpha, side='right')
+        eigenfunctions = np.zeros((n+1, n+1))
+        eigenfunctions[:n, :position] = self._eigenfunctions[:, :position]
+        eigenfunctions[:n, position+1:] = self._eigenfunctions[:, position:]
+        eigenfunctions[n, position] = 1.0
+        self._eigenvalues = np.insert(self._eigenvalues, position, alpha)
+        self._eigenfunctions = eigenfunctions
+        self._energy_stale = True
+        self.n_skipped_diagonalizations += 1
+
+    def _ensure_solved(self):
+        if self._stale:
+            self.update()
+        elif self._energy_stale:
+            self._huckel_energy = self.compute_huckel_energy(self._eigenvalues)
+            self._energy_stale = False
+
+    @property
+    def eigenvalues(self):
+        self._ensure_solved()
+        return self._eigenvalues
+
+    @property
+    def eigenfunctions(self):
+        self._ensure_solved()
+        return self._eigenfunctions
+
+    @property
+    def huckel_energy(self):
+        self._ensure_solved()
+        return self._huckel_energy
 
     def get_name(self):
         return self.name
@@ -36,6 +536,8 @@ class Wavefunction:
         return self.matrix
     
     def get_occupation(self):
+        if self.n_electrons is not None:
+            self._ensure_solved()
         return self.occupation
     
     def get_eigenvalues(self):
@@ -52,11 +554,40 @@ class Wavefunction:
     
     def set_occupation(self, occupation):
         self.occupation = occupation
-        self.update()
+        self.n_electrons = None
+        if self.sparse and self._eigenvalues is not None \
+                and self.get_number_of_occupied_orbitals() > len(self._eigenvalues):
+            # more orbitals are occupied than the sparse solver computed
+            self.invalidate()
+            return
+        # the eigen-solution does not depend on the occupation, only the energy does
+        self.n_skipped_diagonalizations += 1
+        self._energy_stale = True
+
+    def set_electron_count(self, n_electrons):
+        """
+        Occupies the orbitals with n_electrons electrons by the aufbau principle (see
+        aufbau_occupation); the occupation is rebuilt from the eigenvalues whenever the solution
+        changes, without diagonalizing anything itself. set_occupation returns to an explicit
+        occupation.
+
+        Args:
+            n_electrons (float): The number of electrons.
+        """
+        if n_electrons == self.n_electrons:
+            return
+        if self.sparse and self._eigenvalues is not None and -(-int(np.ceil(n_electrons)) // 2) > len(self._eigenvalues):
+            # more orbitals are occupied than the sparse solver computed
+            self.n_electrons = n_electrons
+            self.invalidate()
+            return
+        self.n_electrons = n_electrons
+        self._energy_stale = True
 
     def set_matrix(self, matrix):
-        self.matrix = matrix
-        self.update()
+        self.matrix = self._as_sparse(matrix) if self.sparse else matrix
+        self._extendable = False
+        self.invalidate()
 
     def get_eigenfunction(self, i):
         return self.eigenfunctions[:,i]
@@ -64,53 +595,570 @@ class Wavefunction:
     def get_eigenvalue(self, i):
         return self.eigenvalues[i]
     
+    def get_occupied_block(self):
+        """
+        Returns the occupied orbitals stacked as the columns of one array, for overlaps computed as a
+        single matrix product. The block is cached until the solution or the occupation changes.
+
+        Returns:
+            numpy.ndarray: The (n, n_occupied) array of the occupied eigenfunctions.
+        """
+        eigenfunctions = self.eigenfunctions
+        cached = self._occupied_block
+        if cached is not None and cached[0] is eigenfunctions and cached[1] is self.occupation:
+            return cached[2]
+        if eigenfunctions is None:
+            block = np.zeros((0, int(np.count_nonzero(np.asarray(self.occupation) > 0))))
+        else:
+            block = np.ascontiguousarray(eigenfunctions[:, self._occupied_columns(eigenfunctions.shape[1])])
+        self._occupied_block = (eigenfunctions, self.occupation, block)
+        return block
+
+    def _occupied_columns(self, n_orbitals):
+        return np.flatnonzero(np.asarray(self.occupation)[:n_orbitals] > 0)
+
     def get_occupied_eigenfunctions(self):
-        occupied_eigenfunctions = []
-        for i in range(len(self.occupation)):
-            if self.occupation[i] > 0:
-                occupied_eigenfunctions.append(self.eigenfunctions[:,i])
-        return occupied_eigenfunctions
+        return list(self.get_occupied_block().T)
+
+    def _occupied_weights(self, block):
+        # the occupations of the columns of the occupied block
+        eigenfunctions = self.eigenfunctions
+        if eigenfunctions is None:
+            return np.zeros(block.shape[1])
+        return np.asarray(self.occupation, dtype=float)[self._occupied_columns(eigenfunctions.shape[1])]
+
+    def get_density_matrix(self):
+        """
+        Returns the occupation-weighted density matrix P = sum_k n_k C_k C_k^T, built by one matrix
+        product on the occupied block and cached until the solution or the occupation changes. Its
+        diagonal holds the pi populations and its elements between bonded centres the pi bond orders;
+        get_pi_properties gives these without the O(n^2) matrix.
+
+        Returns:
+            numpy.ndarray: The (n, n) density matrix.
+        """
+        eigenfunctions = self.eigenfunctions
+        cached = self._density_matrix
+        if cached is not None and cached[0] is eigenfunctions and cached[1] is self.occupation:
+            return cached[2]
+        block = self.get_occupied_block()
+        density = (block * self._occupied_weights(block)) @ block.T
+        self._density_matrix = (eigenfunctions, self.occupation, density)
+        return density
+
+    def get_bonds(self):
+        """
+        Returns:
+            tuple: The arrays of the centres i < j of the non-zero off-diagonal matrix elements.
+        """
+        if self.sparse:
+            rows, cols = scipy.sparse.triu(self.matrix, k=1).nonzero()
+        elif self.get_size() == 0:
+            rows, cols = np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+        else:
+            rows, cols = np.nonzero(np.triu(np.asarray(self.matrix), k=1))
+        return rows, cols
+
+    def get_bond_orders(self, rows=None, cols=None):
+        """
+        Pi bond orders p_ij = sum_k n_k C_ik C_jk, computed for the given pairs only, in O(n_occupied)
+        per pair.
+
+        Args:
+            rows (numpy.ndarray): The first centres of the pairs; by default the bonds of get_bonds.
+            cols (numpy.ndarray): The second centres of the pairs.
+
+        Returns:
+            numpy.ndarray: The bond orders of the pairs.
+        """
+        if rows is None:
+            return self.get_pi_properties()['bond_orders']
+        block = self.get_occupied_block()
+        rows = np.asarray(rows, dtype=int)
+        cols = np.asarray(cols, dtype=int)
+        return np.einsum('ij,ij,j->i', block[rows], block[cols], self._occupied_weights(block))
+
+    def get_pi_properties(self):
+        """
+        Computes the pi populations, the charges, the bond orders of the bonds and the free valences in
+        one pass over the occupied block, in O((n + E) n_occupied) without the density matrix, and
+        caches them until the solution or the occupation changes.
+
+        The charge of a centre is 1 - its population (one pi electron per centre) and its free valence
+        is max_bond_order_sum - the sum of the orders of its bonds.
+
+        Returns:
+            dict: The (n,) arrays 'populations', 'charges' and 'free_valences', the bonds 'rows' and
+            'cols' (see get_bonds) and their 'bond_orders'.
+        """
+        eigenfunctions = self.eigenfunctions
+        cached = self._pi_properties
+        if cached is not None and cached[0] is eigenfunctions and cached[1] is self.occupation:
+            return cached[2]
+        block = self.get_occupied_block()
+        weights = self._occupied_weights(block)
+        n = self.get_size()
+        rows, cols = self.get_bonds()
+        populations = (block * block) @ weights
+        bond_orders = np.einsum('ij,ij,j->i', block[rows], block[cols], weights)
+        bond_order_sums = np.bincount(rows, bond_orders, minlength=n) + np.bincount(cols, bond_orders, minlength=n)
+        properties = {
+            'populations': populations,
+            'charges': 1.0 - populations,
+            'rows': rows,
+            'cols': cols,
+            'bond_orders': bond_orders,
+            'free_valences': self.max_bond_order_sum - bond_order_sums,
+        }
+        self._pi_properties = (eigenfunctions, self.occupation, properties)
+        return properties
+
+    def get_populations(self):
+        return self.get_pi_properties()['populations']
+
+    def get_charges(self):
+        return self.get_pi_properties()['charges']
+
+    def get_free_valences(self):
+        return self.get_pi_properties()['free_valences']
     
     def get_overlap_matrix(self, that):
-        occ_MO_this = self.get_occupied_eigenfunctions()
-        occ_MO_that = that.get_occupied_eigenfunctions()
-        overlap_matrix = np.zeros((len(occ_MO_this), len(occ_MO_that)))  # Define overlap_matrix
-        for i in range(len(occ_MO_this)):
-            MO_i = occ_MO_this[i]
-            for j in range(len(occ_MO_that)):
-                MO_j = occ_MO_that[j]
-                overlap_matrix[i][j] = np.dot(MO_i, MO_j)
-        return overlap_matrix
+        support = that.get_occupied_support()
+        if support is not None:
+            return gather_overlap(self.get_occupied_block(), support)
+        support = self.get_occupied_support()
+        if support is not None:
+            return gather_overlap(that.get_occupied_block(), support).T
+        return self.get_occupied_block().T @ that.get_occupied_block()
+
+    def get_log_overlap_wf(self, that):
+        """
+        Overlap of the two determinantal wavefunctions as a sign and a logarithm, which do not
+        underflow when the overlap is the product of many small factors, as in large systems.
+
+        Returns:
+            tuple: The sign (-1, 0 or 1) and the natural logarithm of the absolute overlap.
+        """
+        return np.linalg.slogdet(self.get_overlap_matrix(that))
 
     def get_overlap_wf(self, that):
-        overlap_matrix = self.get_overlap_matrix(that)
-        print(overlap_matrix)
-        overlap_wf = np.linalg.det(overlap_matrix)
-        return overlap_wf
-    
-def read_wavefunctions_from_xml(file_path):
+        sign, log_overlap = self.get_log_overlap_wf(that)
+        return sign * np.exp(log_overlap)
+
+    def get_log_overlaps_wf(self, wavefunctions):
+        """
+        Overlaps of this wavefunction, taken as the reference, with many others at once: the
+        occupied block of the reference is built once and multiplied by all the stacked occupied
+        blocks in a single GEMM, followed by one batched slogdet, instead of one get_overlap_wf
+        call per wavefunction. Matching-type wavefunctions only need gathers of its rows.
+
+        Args:
+            wavefunctions (list): The K wavefunctions to compare with the reference.
+
+        Returns:
+            tuple: The arrays of the K signs and of the K logarithms of the absolute overlaps, NaN for
+            the wavefunctions whose occupied block differs in shape.
+        """
+        supports = [wf.get_occupied_support() for wf in wavefunctions]
+        blocks = [wf.get_occupied_block() if support is None else None for wf, support in zip(wavefunctions, supports)]
+        return log_overlap_row(self.get_occupied_block(), blocks, supports)
+
+    def get_overlaps_wf(self, wavefunctions):
+        """
+        Returns:
+            numpy.ndarray: The overlaps of this wavefunction with each of the wavefunctions, see
+            get_log_overlaps_wf.
+        """
+        signs, logs = self.get_log_overlaps_wf(wavefunctions)
+        return signs * np.exp(logs)
+
+
+class WavefunctionBatch:
+    """
+    Huckel solutions of a stack of matrices of the same size, e.g. a scan of the beta/alpha
+    parameters or of the geometry of one molecule.
+
+    The whole stack is diagonalized by one batched numpy.linalg.eigh call when a result is first
+    requested; the descending ordering of the orbitals and the occupation-weighted Huckel energies
+    are then computed for all the matrices at once, and the results are kept as (batch, ...)
+    arrays. Wavefunction objects are only built on access to an item, from the stored solution.
+
+    Without eigenfunctions, only the eigenvalues are computed (numpy.linalg.eigvalsh), which is enough
+    for energy scans.
+    """
+
+    def __init__(self, name, matrices, occupation, eigenfunctions=True):
+        """
+        Args:
+            name (str): The name of the batch; item i is named name + str(i).
+            matrices (numpy.ndarray): The (batch, n, n) stack of symmetric matrices.
+            occupation (list): The occupation shared by all the matrices, or a (batch, m) array of
+                per-matrix occupations.
+            eigenfunctions (bool): Also compute the eigenfunctions.
+        """
+        self.name = name
+        self.matrices = np.asarray(matrices, dtype=float)
+        if self.matrices.ndim != 3 or self.matrices.shape[1] != self.matrices.shape[2]:
+            raise ValueError("matrices must be a (batch, n, n) stack of square matrices")
+        self.occupation = np.asarray(occupation, dtype=float)
+        self.with_eigenfunctions = eigenfunctions
+        self._eigenvalues = None
+        self._eigenfunctions = None
+        self._huckel_energies = None
+
+    def __len__(self):
+        return len(self.matrices)
+
+    def __getitem__(self, i):
+        i = range(len(self))[i]
+        occupation = self.occupation[i] if self.occupation.ndim == 2 else self.occupation
+        wf = Wavefunction(self.name + str(i), self.matrices[i], occupation.tolist())
+        if self.with_eigenfunctions:
+            wf.set_solution(self.get_eigenvalues()[i], self.get_eigenfunctions()[i])
+        return wf
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def get_size(self):
+        return self.matrices.shape[1]
+
+    def solve(self):
+        """
+        Diagonalizes the whole stack, whether or not it was already solved.
+        """
+        if self.with_eigenfunctions:
+            eigenvalues, eigenfunctions = np.linalg.eigh(self.matrices)
+            # eigh sorts in ascending order: reversing gives the descending order of Wavefunction
+            self._eigenfunctions = eigenfunctions[:, :, ::-1]
+        else:
+            eigenvalues = np.linalg.eigvalsh(self.matrices)
+        self._eigenvalues = eigenvalues[:, ::-1]
+        m = min(self.occupation.shape[-1], self.get_size())
+        occupation = self.occupation[..., :m]
+        if occupation.ndim == 2:
+            self._huckel_energies = np.einsum('bi,bi->b', self._eigenvalues[:, :m], occupation)
+        else:
+            self._huckel_energies = self._eigenvalues[:, :m] @ occupation
+
+    def get_eigenvalues(self):
+        """
+        Returns:
+            numpy.ndarray: The (batch, n) eigenvalues, in descending order along each row.
+        """
+        if self._eigenvalues is None:
+            self.solve()
+        return self._eigenvalues
+
+    def get_eigenfunctions(self):
+        """
+        Returns:
+            numpy.ndarray: The (batch, n, n) eigenfunctions, as columns in the order of the eigenvalues.
+        """
+        if not self.with_eigenfunctions:
+            raise ValueError("the batch was created without eigenfunctions")
+        if self._eigenfunctions is None:
+            self.solve()
+        return self._eigenfunctions
+
+    def get_huckel_energies(self):
+        """
+        Returns:
+            numpy.ndarray: The (batch,) Huckel energies.
+        """
+        if self._huckel_energies is None:
+            self.solve()
+        return self._huckel_energies
+
+
+def aufbau_occupation(eigenvalues, n_electrons, tolerance=1e-8):
+    """
+    Fills the orbitals by pairs of electrons in the order of the eigenvalues, descending, i.e. from
+    the most bonding Huckel orbital. The orbitals of a degenerate shell, whose eigenvalues differ by
+    less than tolerance relative to the largest one, share the electrons of a partly filled shell
+    equally, e.g. one electron in each of the two non-bonding orbitals of cyclobutadiene.
+
+    Args:
+        eigenvalues (numpy.ndarray): The eigenvalues, in descending order.
+        n_electrons (float): The number of electrons, at most twice the number of orbitals.
+        tolerance (float): The relative gap below which orbitals are degenerate.
+
+    Returns:
+        numpy.ndarray: The occupation of each orbital.
+    """
+    eigenvalues = np.asarray(eigenvalues, dtype=float)
+    n = len(eigenvalues)
+    if n_electrons > 2 * n:
+        raise ValueError("{} electrons do not fit in {} orbitals".format(n_electrons, n))
+    if n == 0:
+        return np.zeros(0)
+    scale = max(np.abs(eigenvalues).max(), 1.0)
+    starts = np.concatenate(([0], np.flatnonzero(np.abs(np.diff(eigenvalues)) > tolerance * scale) + 1))
+    sizes = np.diff(np.append(starts, n))
+    capacities = 2.0 * sizes
+    shell_electrons = np.clip(n_electrons - (np.cumsum(capacities) - capacities), 0.0, capacities)
+    return np.repeat(shell_electrons / sizes, sizes)
+
+
+def _support_to_dense(n, support):
+    # the dense eigenfunctions of orbitals given by their two-centre support
+    centres, partners, coefficients, partner_coefficients = support
+    eigenfunctions = np.zeros((n, len(centres)))
+    orbitals = np.arange(len(centres))
+    # the partner first: for a lone centre it is the centre itself, with a zero coefficient
+    eigenfunctions[partners, orbitals] = partner_coefficients
+    eigenfunctions[centres, orbitals] = coefficients
+    return eigenfunctions
+
+
+def _connected_components(matrix):
+    """
+    Connected components of the graph whose edges are the non-zero off-diagonal matrix elements.
+
+    Args:
+        matrix (numpy.ndarray): A symmetric matrix.
+
+    Returns:
+        list: The sorted index arrays of the components, ordered by their first index.
+    """
+    n = len(matrix)
+    parent = list(range(n))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    rows, cols = np.nonzero(np.triu(matrix, 1))
+    for i, j in zip(rows.tolist(), cols.tolist()):
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+    roots = np.array([find(i) for i in range(n)], dtype=int)
+    order = np.argsort(roots, kind='stable')
+    boundaries = np.flatnonzero(np.diff(roots[order])) + 1
+    return np.split(order, boundaries)
+
+
+def iter_wavefunctions_from_xml(file_path, progress=None, sparse=False):
+    """
+    Read wavefunctions from an XML file one at a time.
+
+    A matrix is given either densely, as one <row> per centre, or as an edge list when the
+    <wavefunction> element has a size attribute (see write_wavefunctions_to_xml):
+    - <bonds>i j k l ...</bonds> lists the pairs of bonded centres, with matrix element 1;
+    - <bond i="..." j="..." beta="..."/> sets one element, and i == j sets a diagonal element.
+
+    The file is parsed incrementally: each <row> is parsed straight into a preallocated array and the
+    parsed elements are freed as soon as their wavefunction has been built, so memory does not grow
+    with the number of wavefunctions in the file.
+
+    Args:
+        file_path (str): The path to the XML file.
+        progress (callable): Called as progress(count, name) after each wavefunction is read.
+        sparse (bool): Build sparse mode wavefunctions; edge lists are then never expanded densely.
+
+    Yields:
+        Wavefunction: The wavefunctions, in file order.
+    """
+    count = 0
+    root = None
+    matrix = None
+    n_rows = 0
+    size = None
+    edges = []
+    for event, element in ET.iterparse(file_path, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = element
+            elif element.tag == 'wavefunction':
+                matrix = None
+                n_rows = 0
+                size = element.get('size')
+                edges = []
+            continue
+        if element.tag == 'row':
+            row = np.fromstring(element.text or '', sep=' ')
+            if matrix is None:
+                matrix = np.empty((len(row), len(row)))
+            if n_rows >= len(matrix) or len(row) != len(matrix):
+                raise ValueError("wavefunction matrix is not square in {}".format(file_path))
+            matrix[n_rows] = row
+            n_rows += 1
+            element.clear()
+        elif element.tag == 'bonds':
+            pairs = np.fromstring(element.text or '', dtype=int, sep=' ')
+            if len(pairs) % 2:
+                raise ValueError("odd number of centres in <bonds> in {}".format(file_path))
+            edges.append((pairs[0::2], pairs[1::2], np.ones(len(pairs) // 2)))
+            element.clear()
+        elif element.tag == 'bond':
+            edges.append(([int(element.get('i'))], [int(element.get('j'))], [float(element.get('beta', 1.0))]))
+            element.clear()
+        elif element.tag == 'wavefunction':
+            name = element.get('name')
+            if size is not None:
+                matrix = _matrix_from_edges(int(size), edges, sparse)
+            elif edges:
+                raise ValueError("wavefunction {} has bonds but no size attribute in {}".format(name, file_path))
+            elif matrix is None:
+                matrix = np.zeros((0, 0))
+            elif n_rows != len(matrix):
+                raise ValueError("wavefunction {} has {} rows instead of {}".format(name, n_rows, len(matrix)))
+            occupation = [float(i) for i in element.find('occupation').text.split()]
+            wf = Wavefunction(name, matrix, occupation, sparse=sparse)
+            count += 1
+            logger.info("Read wavefunction %s", name)
+            if progress is not None:
+                progress(count, name)
+            # drop the parsed element and the references the root keeps to it
+            element.clear()
+            root.clear()
+            yield wf
+
+
+def _matrix_from_edges(size, edges, sparse):
+    rows = np.concatenate([np.asarray(i, dtype=int) for i, _, _ in edges]) if edges else np.zeros(0, dtype=int)
+    cols = np.concatenate([np.asarray(j, dtype=int) for _, j, _ in edges]) if edges else np.zeros(0, dtype=int)
+    values = np.concatenate([np.asarray(v, dtype=float) for _, _, v in edges]) if edges else np.zeros(0)
+    if len(rows) and (min(rows.min(), cols.min()) < 0 or max(rows.max(), cols.max()) >= size):
+        raise ValueError("bond between centres outside 0..{}".format(size - 1))
+    # each bond is given once, the symmetric element is implied
+    off_diagonal = rows != cols
+    rows, cols = np.concatenate((rows, cols[off_diagonal])), np.concatenate((cols, rows[off_diagonal]))
+    values = np.concatenate((values, values[off_diagonal]))
+    # a repeated bond sets the element again instead of adding to it: keep the last occurrence
+    last = len(rows) - 1 - np.unique((rows * size + cols)[::-1], return_index=True)[1]
+    rows, cols, values = rows[last], cols[last], values[last]
+    if sparse:
+        if scipy is None:
+            raise ImportError("the sparse mode of Wavefunction requires scipy")
+        return scipy.sparse.csr_matrix((values, (rows, cols)), shape=(size, size))
+    matrix = np.zeros((size, size))
+    matrix[rows, cols] = values
+    return matrix
+
+
+def write_wavefunctions_to_xml(wavefunctions, file_path, edge_list=True):
+    """
+    Write wavefunctions to an XML file, one element at a time.
+
+    In the edge-list format the file size only grows with the number of bonds: the bonds of matrix
+    element 1 are written as pairs in a single <bonds> element, the other non-zero elements (including
+    the diagonal ones) as <bond i="..." j="..." beta="..."/>. The dense format writes one <row> per
+    centre, as read by older versions.
+
+    Args:
+        wavefunctions (iterable): The wavefunctions, e.g. from iter_wavefunctions_from_xml.
+        file_path (str): The path to the XML file.
+        edge_list (bool): Write the edge-list format instead of dense rows.
+
+    Returns:
+        int: The number of wavefunctions written.
+    """
+    count = 0
+    with open(file_path, 'w') as f:
+        f.write('<decomposition>\n')
+        for wf in wavefunctions:
+            matrix = wf.get_matrix()
+            name = wf.get_name()
+            occupation = " ".join('%.17g' % i for i in wf.get_occupation())
+            if edge_list:
+                if scipy is not None and scipy.sparse.issparse(matrix):
+                    upper = scipy.sparse.triu(matrix).tocoo()
+                    rows, cols, values = upper.row, upper.col, upper.data
+                else:
+                    rows, cols = np.nonzero(np.triu(matrix))
+                    values = np.asarray(matrix)[rows, cols]
+                keep = values != 0
+                rows, cols, values = rows[keep], cols[keep], values[keep]
+                unit = (values == 1) & (rows != cols)
+                f.write('    <wavefunction name={} size="{}">\n'.format(_quote(name), wf.get_size()))
+                pairs = np.stack((rows[unit], cols[unit]), axis=1).ravel()
+                f.write('        <bonds>{}</bonds>\n'.format(" ".join(map(str, pairs.tolist()))))
+                for i, j, value in zip(rows[~unit].tolist(), cols[~unit].tolist(), values[~unit].tolist()):
+                    f.write('        <bond i="{}" j="{}" beta="{!r}"/>\n'.format(i, j, value))
+            else:
+                f.write('    <wavefunction name={}>\n'.format(_quote(name)))
+                dense = matrix.toarray() if scipy is not None and scipy.sparse.issparse(matrix) else np.asarray(matrix)
+                for row in dense:
+                    f.write('        <row>{}</row>\n'.format(" ".join("{:g}".format(x) if x == int(x) else repr(float(x)) for x in row)))
+            f.write('        <occupation>{}</occupation>\n'.format(occupation))
+            f.write('    </wavefunction>\n')
+            count += 1
+        f.write('</decomposition>\n')
+    return count
+
+
+def _quote(text):
+    return '"{}"'.format(text.replace('&', '&amp;').replace('<', '&lt;').replace('"', '&quot;'))
+
+
+def convert_xml(input_path, output_path, edge_list=True, progress=None):
+    """
+    Convert a decomposition file between the dense and the edge-list formats, streaming the
+    wavefunctions so that the whole file is never held in memory.
+
+    Returns:
+        int: The number of wavefunctions converted.
+    """
+    return write_wavefunctions_to_xml(iter_wavefunctions_from_xml(input_path, progress), output_path, edge_list)
+
+
+def read_wavefunctions_from_xml(file_path, progress=None, sparse=False):
     """
     Read wavefunctions from an XML file.
 
     Args:
         file_path (str): The path to the XML file.
+        progress (callable): Called as progress(count, name) after each wavefunction is read.
+        sparse (bool): Build sparse mode wavefunctions.
 
     Returns:
-        list: A list of matrices extracted from the XML file.
-    """
-    wavefunctions = []
-    tree = ET.parse(file_path)
-    root = tree.getroot()
-    for wavefunction in root.findall('wavefunction'):
-        name = wavefunction.get('name')
-        print("Reading wavefunction... {}".format(name))
-        matrix = []
-        for row in wavefunction.findall('row'):
-            matrix.append([float(el) for el in row.text.split(' ')])
-        occupation = [ int(i) for i in wavefunction.find('occupation').text.split(' ') ]
-        wf = Wavefunction(name, np.array(matrix), occupation)
-        wavefunctions.append(wf)
-        print("done")
-    return wavefunctions
+        list: A list of the wavefunctions extracted from the XML file.
+    """
+    return list(iter_wavefunctions_from_xml(file_path, progress, sparse))
+
 
+def group_equivalent_wavefunctions(wavefunctions):
+    """
+    Groups the wavefunctions whose matrices are equal up to a relabelling of the centres and whose
+    occupations (or electron counts) are equal, e.g. the structures of a decomposition related by a symmetry of the
+    molecule (see chem_symmetry.group_isomorphic). Every member of a class is linked to its
+    representative with set_equivalent, so that only the representatives are diagonalized and the
+    other solutions are derived from theirs when first read. Sparse wavefunctions are left alone,
+    each in its own class.
+
+    Args:
+        wavefunctions (list): The wavefunctions.
 
+    Returns:
+        list: The classes, as lists of wavefunctions starting with their representative, in the order
+        of the representatives.
+    """
+    wavefunctions = list(wavefunctions)
+    position = {id(wf): i for i, wf in enumerate(wavefunctions)}
+    by_occupation = {}
+    classes = []
+    for wf in wavefunctions:
+        if wf.sparse:
+            classes.append([wf])
+        else:
+            # an aufbau occupation is the same for equivalent matrices: group on the electron count
+            # rather than solving every member to read its occupation
+            if wf.n_electrons is not None:
+                key = ('n', wf.n_electrons)
+            else:
+                key = tuple(np.asarray(wf.occupation, dtype=float).tolist())
+            by_occupation.setdefault(key, []).append(wf)
+    for members in by_occupation.values():
+        for group in group_isomorphic([np.asarray(wf.get_matrix(), dtype=float) for wf in members]):
+            representative = members[group[0][0]]
+            for index, sigma in group[1:]:
+                members[index].set_equivalent(representative, sigma)
+            classes.append([members[index] for index, _ in group])
+    classes.sort(key=lambda members: position[id(members[0])])
+    logger.info("%d wavefunctions in %d classes of equivalent matrices", len(wavefunctions), len(classes))
+    return classes
@@ -1,68 +1,194 @@
+from contextlib import contextmanager
+
 from dessin_molecule import DessinMolecule
 from chem_molecule import Molecule
-from params import TYPE_ATOME
+from params import TYPE_ATOME, params
 import numpy as np
 
+# distance between an atom and the hydrogens drawn around it
+HYDROGEN_DISTANCE = 50
+
 class Control_Center:
-    def __init__(self, canvas_molecule):
+    def __init__(self, canvas_molecule, implicit_hydrogens=None):
+        """
+        Parameters:
+        - canvas_molecule (tkinter.Canvas): The canvas the molecule is drawn on.
+        - implicit_hydrogens (bool): Keep the hydrogens of the atoms as counts shown in their labels
+          instead of creating hydrogen atoms, drawings and bonds; params['implicit_hydrogens'] by
+          default. The hydrogens are created on request with make_hydrogens_explicit().
+        """
         self.molecule = Molecule()
         self.canvas_molecule = canvas_molecule
         self.dessin_molecule = DessinMolecule(self.canvas_molecule)
-        self.correspondance = {"atome_dessin":[], "liaison_dessin":[]}
+        # bidirectional index between the model and its drawings, keyed by object identity
+        self.correspondance = {"atome_dessin":{}, "dessin_atome":{}, "liaison_dessin":{}, "dessin_liaison":{}}
+        if implicit_hydrogens is None:
+            implicit_hydrogens = params['implicit_hydrogens']
+        self.implicit_hydrogens = implicit_hydrogens
+
+    def begin_edit(self):
+        """
+        Starts a batch of edits: the wavefunction update and the canvas redraw are deferred
+        until the matching commit_edit().
+        """
+        self.molecule.begin_edit()
+        self.dessin_molecule.begin_edit()
+
+    def commit_edit(self):
+        """
+        Ends a batch of edits, updating the wavefunction and redrawing the canvas at most once.
+        """
+        try:
+            self.molecule.commit_edit()
+        finally:
+            self.dessin_molecule.commit_edit()
+
+    @contextmanager
+    def edit(self):
+        """
+        Context manager wrapping begin_edit() and commit_edit(), e.g. to paste a fragment or build a ring.
+        """
+        self.begin_edit()
+        try:
+            yield self
+        finally:
+            self.commit_edit()
 
     def add_atom(self, x, y, type):
-        atome = self.molecule.add_atom(type)
-        dessin_atome = self.dessin_molecule.add_dessin_atome(x, y, type)
-        self.correspondance["atome_dessin"].append((atome, dessin_atome))
-        if type.value == "CARBONEsp2":
-            for i in range(3):
-                xH = x + 50*np.cos(2*np.pi/3*(i+1))
-                yH = y + 50*np.sin(2*np.pi/3*(i+1))
-                _ , dessin_hydrogene = self.add_atom(xH, yH, TYPE_ATOME.HYDROGENE)
-                self.add_bond(dessin_atome, dessin_hydrogene)
+        with self.edit():
+            atome = self.molecule.add_atom(type)
+            dessin_atome = self.dessin_molecule.add_dessin_atome(x, y, type)
+            self._link_atome(atome, dessin_atome)
+            if not self.implicit_hydrogens and type.value == "CARBONEsp2":
+                self.make_hydrogens_explicit([atome])
+            self.update_hydrogens([atome])
         return atome, dessin_atome
     
     def remove_atom(self, dessin_atome):
-        self.dessin_molecule.remove_dessin_atome(dessin_atome)
-        atome = self.get_atome_from_dessin(dessin_atome)
-        self.molecule.remove_atom(atome)
-        self.correspondance["atome_dessin"].remove((atome, dessin_atome))
+        """
+        Removes the atom of a drawing together with the hydrogens and bonds the molecule removes with
+        it, and their drawings.
+        """
+        with self.edit():
+            atome = self.get_atome_from_dessin(dessin_atome)
+            neighbours = self.molecule.get_neighbours(atome)
+            atomes, liaisons = self.molecule.remove_atom(atome)
+            dessins_atomes = [self._unlink_atome(removed) for removed in atomes]
+            dessins_liaisons = [self._unlink_liaison(removed) for removed in liaisons]
+            self.dessin_molecule.remove_dessins([dessin for dessin in dessins_atomes if dessin is not None],
+                                                [dessin for dessin in dessins_liaisons if dessin is not None])
+            self.update_hydrogens([neighbour for neighbour in neighbours if neighbour.index is not None])
 
     def add_bond(self, dessin_atome1, dessin_atome2):
         atome1 = self.get_atome_from_dessin(dessin_atome1)
         atome2 = self.get_atome_from_dessin(dessin_atome2)
+        liaison = self.molecule.get_bond_between(atome1, atome2)
+        if liaison is not None:
+            # dragging between two bonded atoms keeps their bond
+            return liaison, self.get_dessin_from_liaison(liaison)
         dessin_liaison = self.dessin_molecule.add_dessin_liaison(dessin_atome1, dessin_atome2)
         liaison = self.molecule.add_bond(atome1, atome2)
-        self.correspondance["liaison_dessin"].append((liaison, dessin_liaison))
+        self._link_liaison(liaison, dessin_liaison)
+        self.update_hydrogens([atome1, atome2])
+        return liaison, dessin_liaison
 
     def remove_bond(self, dessin_liaison):
         liaison = self.get_liaison_from_dessin(dessin_liaison)
-        self.molecule.remove_bond(liaison)
-        self.dessin_molecule.remove_liaison(dessin_liaison)
+        with self.edit():
+            self.molecule.remove_bond(liaison)
+            self.dessin_molecule.remove_dessin_liaison(dessin_liaison)
+            self._unlink_liaison(liaison)
+            self.update_hydrogens([liaison.atome1, liaison.atome2])
+
+    def update_hydrogens(self, atomes=None):
+        """
+        Shows the implicit hydrogens of the given atoms, all by default, in the labels of their drawings.
+        """
+        if atomes is None:
+            atomes = list(self.correspondance["atome_dessin"])
+        for atome in atomes:
+            dessin_atome = self.get_dessin_from_atome(atome)
+            if dessin_atome is not None:
+                dessin_atome.set_hydrogens(self.molecule.get_number_of_implicit_hydrogens(atome))
+
+    def make_hydrogens_explicit(self, atomes=None):
+        """
+        Turns the implicit hydrogens of the given atoms, all by default, into hydrogen atoms, drawn
+        around their atom away from its other bonds.
+
+        Returns:
+        - list: The drawings of the new hydrogens.
+        """
+        dessins_hydrogenes = []
+        with self.edit():
+            liaisons = self.molecule.make_hydrogens_explicit(atomes)
+            for atome, group in _group_by_atom(liaisons):
+                dessin_atome = self.get_dessin_from_atome(atome)
+                directions = [np.arctan2(dessin.y - dessin_atome.y, dessin.x - dessin_atome.x)
+                              for dessin in map(self.get_dessin_from_atome, self.molecule.get_neighbours(atome))
+                              if dessin is not None]
+                for liaison, angle in zip(group, _free_directions(directions, len(group))):
+                    xH = dessin_atome.x + HYDROGEN_DISTANCE*np.cos(angle)
+                    yH = dessin_atome.y + HYDROGEN_DISTANCE*np.sin(angle)
+                    dessin_hydrogene = self.dessin_molecule.add_dessin_atome(xH, yH, TYPE_ATOME.HYDROGENE)
+                    self._link_atome(liaison.atome2, dessin_hydrogene)
+                    dessin_liaison = self.dessin_molecule.add_dessin_liaison(dessin_atome, dessin_hydrogene)
+                    self._link_liaison(liaison, dessin_liaison)
+                    dessins_hydrogenes.append(dessin_hydrogene)
+                dessin_atome.set_hydrogens(0)
+        return dessins_hydrogenes
+
+    def _link_atome(self, atome, dessin_atome):
+        self.correspondance["atome_dessin"][atome] = dessin_atome
+        self.correspondance["dessin_atome"][dessin_atome] = atome
+
+    def _unlink_atome(self, atome):
+        # returns the drawing of the atom, None if it had none
+        dessin_atome = self.correspondance["atome_dessin"].pop(atome, None)
+        self.correspondance["dessin_atome"].pop(dessin_atome, None)
+        return dessin_atome
+
+    def _link_liaison(self, liaison, dessin_liaison):
+        self.correspondance["liaison_dessin"][liaison] = dessin_liaison
+        self.correspondance["dessin_liaison"][dessin_liaison] = liaison
+
+    def _unlink_liaison(self, liaison):
+        # returns the drawing of the bond, None if it had none
+        dessin_liaison = self.correspondance["liaison_dessin"].pop(liaison, None)
+        self.correspondance["dessin_liaison"].pop(dessin_liaison, None)
+        return dessin_liaison
 
     def get_dessinAtom_at_position(self, x, y):
         return self.dessin_molecule.get_dessinAtom_at_position(x, y)
     
     def get_atome_from_dessin(self, dessin_atome):
-        for atome, dessin in self.correspondance["atome_dessin"]:
-            if dessin == dessin_atome:
-                return atome
-        return None
-
-    def get_dessin_from_atome(self, at):
-        for atome, dessin in self.correspondance["atome_dessin"]:
-            if at == atome:
-                return dessin
-        return None
+        return self.correspondance["dessin_atome"].get(dessin_atome)
+
+    def get_dessin_from_atome(self, atome):
+        return self.correspondance["atome_dessin"].get(atome)
     
     def get_liaison_from_dessin(self, dessin_liaison):
-        for liaison, dessin in self.correspondance["liaison_dessin"]:
-            if dessin == dessin_liaison:
-                return liaison
-        return None
+        return self.correspondance["dessin_liaison"].get(dessin_liaison)
     
     def get_dessin_from_liaison(self, liaison):
-        for liaison, dessin in self.correspondance["liaison_dessin"]:
-            if liaison == liaison:
-                return dessin
-        return None
\ No newline at end of file
+        return self.correspondance["liaison_dessin"].get(liaison)
+
+
+def _group_by_atom(liaisons):
+    # the new hydrogen bonds grouped by the atom carrying them, in order
+    groups = {}
+    for liaison in liaisons:
+        groups.setdefault(liaison.atome1, []).append(liaison)
+    return groups.items()
+
+
+def _free_directions(directions, count):
+    """
+    Returns count of the three sp2 directions around an atom, aligned on its first bond, taking the
+    ones farthest from its bonds first.
+    """
+    base = directions[0] if directions else 0.0
+    candidates = [base + 2*np.pi/3*(i+1) for i in range(3)]
+    def clearance(angle):
+        return min((abs(np.angle(np.exp(1j*(angle - direction)))) for direction in directions), default=np.pi)
+    return sorted(candidates, key=clearance, reverse=True)[:count]
@@ -12,6 +12,7 @@ class DessinAtome:
         params (dict): Les paramètres de dessin de l'atome.
         circle (int): L'identifiant du cercle dessiné pour l'atome.
         label (int ou None): L'identifiant du label de l'atome (s'il existe).
+        hydrogens (int): Le nombre d'hydrogènes implicites, affichés dans le label (CH, CH2...).
     """
 
     def __init__(self, canvas, x, y, atom_type: TYPE_ATOME):
@@ -29,6 +30,7 @@ class DessinAtome:
         self.y = y
         self.atom_type = atom_type
         self.params = params[atom_type.value]
+        self.hydrogens = 0
         self.draw()
 
     def draw(self):
@@ -56,9 +58,35 @@ class DessinAtome:
             int ou None: L'identifiant du label dessiné, ou None si aucun label n'est dessiné.
         """
         if params['show_symbols']:
-            return self.canvas.create_text(self.x, self.y, text=self.params['symbol'])
+            return self.canvas.create_text(self.x, self.y, text=self.get_symbol())
         return None
 
+    def get_symbol(self):
+        """
+        Retourne le texte du label : le symbole de l'atome suivi de ses hydrogènes implicites.
+
+        Returns:
+            str: Le texte du label, par exemple 'C', 'CH' ou 'CH2'.
+        """
+        if self.hydrogens == 0:
+            return self.params['symbol']
+        if self.hydrogens == 1:
+            return self.params['symbol'] + 'H'
+        return self.params['symbol'] + 'H' + str(self.hydrogens)
+
+    def set_hydrogens(self, hydrogens):
+        """
+        Change le nombre d'hydrogènes implicites de l'atome et met son label à jour.
+
+        Args:
+            hydrogens (int): Le nouveau nombre d'hydrogènes implicites.
+        """
+        if hydrogens == self.hydrogens:
+            return
+        self.hydrogens = hydrogens
+        if self.label:
+            self.canvas.itemconfig(self.label, text=self.get_symbol())
+
     def change_color(self, new_color):
         """
         Change la couleur de l'atome.
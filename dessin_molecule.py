@@ -1,3 +1,5 @@
+from contextlib import contextmanager
+
 import numpy as np
 
 from dessin_atome import DessinAtome
@@ -11,16 +13,20 @@ class DessinMolecule:
 
     Attributes:
         canvas (tkinter.Canvas): Le canvas sur lequel dessiner la molécule.
-        dessins (dict): Un dictionnaire contenant les dessins d'atomes et de liaisons.
+        dessins (dict): Les dessins d'atomes ('atomes') et de liaisons ('liaisons'), chacun rangé dans un
+            dictionnaire indexé par le dessin lui-même, qui garde l'ordre d'ajout et permet de le retirer en O(1).
 
     Methods:
         add_dessin_atome(x, y, type): Ajoute un dessin d'atome à la molécule.
         remove_dessin_atome(dessin_atome): Supprime un dessin d'atome de la molécule.
         remove_dessin_liaison(dessin_liaison): Supprime un dessin de liaison de la molécule.
+        remove_dessins(dessins_atomes, dessins_liaisons): Supprime plusieurs dessins avec un seul redessin.
         get_distance(atome1, atome2): Calcule la distance entre deux atomes.
         toggle_symbols(): Affiche ou masque les labels de tous les atomes de la molécule.
         get_dessinAtom_at_position(x, y): Retourne le dessin de l'atome situé aux coordonnées spécifiées, ou None si aucun atome n'est présent.
         redraw(): Redessine la molécule sur le canvas.
+        request_redraw(): Redessine la molécule, ou diffère le dessin jusqu'à la fin de l'édition en cours.
+        begin_edit(), commit_edit(), edit(): Regroupe plusieurs modifications en un seul redessin.
         optimize(): Optimise la molécule avec le moteur physique pymunk en utilisant des ressorts entre les atomes liés.
     """
 
@@ -32,7 +38,9 @@ class DessinMolecule:
             canvas (tkinter.Canvas): Le canvas sur lequel dessiner la molécule.
         """
         self.canvas = canvas
-        self.dessins = {'atomes': [], 'liaisons': []}
+        self.dessins = {'atomes': {}, 'liaisons': {}}
+        self._edit_depth = 0
+        self._redraw_pending = False
 
     def add_dessin_atome(self, x, y, type: TYPE_ATOME):
         """
@@ -47,7 +55,7 @@ class DessinMolecule:
             DessinAtome: Le dessin d'atome ajouté.
         """
         dessinAtome = DessinAtome(self.canvas, x, y, type)
-        self.dessins['atomes'].append(dessinAtome)
+        self.dessins['atomes'][dessinAtome] = None
         return dessinAtome
     
     def add_dessin_liaison(self, dessin_atome1, dessin_atome2):
@@ -62,7 +70,7 @@ class DessinMolecule:
             DessinLiaison: Le dessin de liaison ajouté.
         """
         dessinLiaison = Dessin_liaison(self.canvas, dessin_atome1, dessin_atome2)
-        self.dessins['liaisons'].append(dessinLiaison)
+        self.dessins['liaisons'][dessinLiaison] = None
         return dessinLiaison
 
     def remove_dessin_atome(self, dessin_atome):
@@ -72,8 +80,8 @@ class DessinMolecule:
         Args:
             dessin_atome (DessinAtome): Le dessin d'atome à supprimer.
         """
-        self.dessins['atomes'].remove(dessin_atome)
-        self.redraw()
+        del self.dessins['atomes'][dessin_atome]
+        self.request_redraw()
 
     def remove_dessin_liaison(self, dessin_liaison):
         """
@@ -82,8 +90,22 @@ class DessinMolecule:
         Args:
             dessin_liaison (DessinLiaison): Le dessin de liaison à supprimer.
         """
-        self.dessins['liaisons'].remove(dessin_liaison)
-        self.redraw()
+        del self.dessins['liaisons'][dessin_liaison]
+        self.request_redraw()
+
+    def remove_dessins(self, dessins_atomes=(), dessins_liaisons=()):
+        """
+        Supprime plusieurs dessins d'atomes et de liaisons, par exemple un atome avec ses hydrogènes et ses liaisons.
+
+        Args:
+            dessins_atomes (iterable): Les dessins d'atomes à supprimer.
+            dessins_liaisons (iterable): Les dessins de liaisons à supprimer.
+        """
+        with self.edit():
+            for dessin_atome in dessins_atomes:
+                self.remove_dessin_atome(dessin_atome)
+            for dessin_liaison in dessins_liaisons:
+                self.remove_dessin_liaison(dessin_liaison)
 
     def get_distance(self, atome1, atome2):
         """
@@ -138,6 +160,43 @@ class DessinMolecule:
             dessin_atome.draw()
         for dessin_liaison in self.dessins['liaisons']:
             dessin_liaison.draw()
+        self._redraw_pending = False
+
+    def request_redraw(self):
+        """
+        Redessine la molécule, ou diffère le dessin jusqu'au commit_edit() si une édition est en cours.
+        """
+        if self._edit_depth > 0:
+            self._redraw_pending = True
+        else:
+            self.redraw()
+
+    def begin_edit(self):
+        """
+        Commence un groupe de modifications : les redessins sont différés jusqu'au commit_edit() correspondant.
+        """
+        self._edit_depth += 1
+
+    def commit_edit(self):
+        """
+        Termine un groupe de modifications et redessine une seule fois si nécessaire.
+        """
+        if self._edit_depth == 0:
+            raise RuntimeError("commit_edit() appelé sans begin_edit() correspondant")
+        self._edit_depth -= 1
+        if self._edit_depth == 0 and self._redraw_pending:
+            self.redraw()
+
+    @contextmanager
+    def edit(self):
+        """
+        Gestionnaire de contexte équivalent à begin_edit() suivi de commit_edit().
+        """
+        self.begin_edit()
+        try:
+            yield self
+        finally:
+            self.commit_edit()
     
     def optimize(self):
         """
@@ -155,13 +214,9 @@ class DessinMolecule:
             dessin_atome.body = body
             dessin_atome.shape = shape
         
-        for liaison, dessin_liaison in self.correspondance["liaison_dessin"]:
-            atome1 = liaison.atome1
-            atome2 = liaison.atome2
-            dessinAtome1 = self.get_dessin_from_atome(atome1)
-            dessinAtome2 = self.get_dessin_from_atome(atome2)
-            body1 = dessinAtome1.body
-            body2 = dessinAtome2.body
+        for dessin_liaison in self.dessins['liaisons']:
+            body1 = dessin_liaison.dessin_atome1.body
+            body2 = dessin_liaison.dessin_atome2.body
             spring = pymunk.DampedSpring(body1, body2, (0, 0), (0, 0), 100, 100, 0.5)
             space.add(spring)
 
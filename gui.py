@@ -73,6 +73,7 @@ class HulisInterface(tk.Frame):
         self.canvas_molecule.bind('<B1-Motion>', self.dragging)
         self.master.bind('l', self.toggle_symbols)
         self.master.bind('o', self.optimize_molecule)
+        self.master.bind('h', self.make_hydrogens_explicit)
         self.master.bind('q', self.quit_app)
 
     def drag_start(self, event):
@@ -169,6 +170,17 @@ class HulisInterface(tk.Frame):
         """
         self.control_center.toggle_symbols()
 
+    def make_hydrogens_explicit(self, event):
+        """
+        Nature : interface, gestion des évènements
+
+        Remplace les hydrogènes implicites de tous les atomes par des atomes d'hydrogène dessinés.
+
+        Args:
+            event (tkinter.Event): L'événement de touche 'h'.
+        """
+        self.control_center.make_hydrogens_explicit()
+
     def quit_app(self, event):
         """
         Nature : interface, gestion des évènements
@@ -1,12 +1,73 @@
 import argparse
+import logging
 import numpy as np
+import chem_cache
+import chem_overlap
+import chem_resonance
+import chem_store
 import chem_wavefunction
 
 def main():
     parser = argparse.ArgumentParser(description="Reads matrices from an xml file and computes the eigenvalues and eigenfunctions")
-    parser.add_argument("input", help="input file in xml format containing the matrices to be analyzed", default="benzene_kekule.xml")
+    parser.add_argument("input", help="input file in xml format, or binary wavefunction store, containing the matrices to be analyzed", default="benzene_kekule.xml")
+    parser.add_argument("--convert", metavar="OUTPUT", help="convert the input file to the compact edge-list format and exit")
+    parser.add_argument("--dense", action="store_true", help="with --convert, write dense rows instead of edge lists")
+    parser.add_argument("--store", metavar="OUTPUT", help="write the wavefunctions and their eigen-solutions to a binary store and exit")
+    parser.add_argument("--overlaps", action="store_true", help="print the matrix of the overlaps between all pairs of wavefunctions")
+    parser.add_argument("--reference", metavar="NAME", help="print the overlaps of the wavefunction NAME with all the wavefunctions")
+    parser.add_argument("--weights", action="store_true", help="with --reference, print the resonance weights of the other wavefunctions in the reference")
+    parser.add_argument("--solver", choices=["auto", "cholesky", "eigen", "cg"], default="auto", help="with --weights, the solver of the resonance equations")
+    parser.add_argument("--output", metavar="FILE", help="with --overlaps, stream the overlap matrix tile by tile to a .npy file, resuming an interrupted run")
+    parser.add_argument("--tile-size", type=int, help="number of wavefunctions per side of the overlap tiles")
+    parser.add_argument("--workers", type=int, default=1, help="number of workers computing the overlaps")
+    parser.add_argument("--processes", action="store_true", help="use worker processes instead of threads")
+    parser.add_argument("--deduplicate", action="store_true", help="diagonalize once per class of matrices equal up to a relabelling of the centres")
+    parser.add_argument("--cache-dir", metavar="DIR", help="keep the eigen-decompositions in DIR and reuse them in later runs")
+    parser.add_argument("--sparse", action="store_true", help="store the matrices as sparse matrices (requires scipy)")
     args = parser.parse_args()
-    wavefunctions = chem_wavefunction.read_wavefunctions_from_xml(args.input)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.cache_dir:
+        chem_cache.default_cache.set_directory(args.cache_dir)
+    if args.convert:
+        n = chem_wavefunction.convert_xml(args.input, args.convert, edge_list=not args.dense)
+        print("Converted {} wavefunctions to {}".format(n, args.convert))
+        return
+    wavefunctions = chem_store.read_wavefunctions(args.input, sparse=args.sparse)
+    if args.deduplicate:
+        wavefunctions = list(wavefunctions)
+        chem_wavefunction.group_equivalent_wavefunctions(wavefunctions)
+    if args.store:
+        n = chem_store.write_store(wavefunctions, args.store)
+        print("Stored {} wavefunctions in {}".format(n, args.store))
+        return
+    if args.reference:
+        reference = next((wf for wf in wavefunctions if wf.get_name() == args.reference), None)
+        if reference is None:
+            parser.error("no wavefunction named {}".format(args.reference))
+        if args.weights:
+            structures = [wf for wf in wavefunctions if wf.get_name() != args.reference]
+            result = chem_resonance.resonance_weights(reference, structures, method=args.solver,
+                                                      n_workers=args.workers, processes=args.processes)
+            print("Resonance weights in {} ({} solver, residual {:.4f}):".format(args.reference, result.method, result.residual))
+            for wf, weight, normalized in zip(structures, result.weights, result.normalized_weights):
+                print("{} {:.4f} {:.4f}".format(wf.get_name(), weight, normalized))
+            return
+        overlaps = reference.get_overlaps_wf(wavefunctions)
+        print("Overlaps with {}:".format(args.reference))
+        for wf, overlap in zip(wavefunctions, overlaps):
+            print("{} {:+.4f}".format(wf.get_name(), overlap))
+        return
+    if args.overlaps and args.output:
+        chem_overlap.write_overlap_matrix(wavefunctions, args.output, n_workers=args.workers, processes=args.processes,
+                                          tile_size=args.tile_size,
+                                          progress=lambda done, total: logging.info("Overlap tile %d/%d", done, total))
+        print("Wrote the overlap matrix to {}".format(args.output))
+        return
+    if args.overlaps:
+        overlaps = chem_overlap.overlap_matrix(wavefunctions, n_workers=args.workers, processes=args.processes,
+                                               tile_size=args.tile_size)
+        print_matrix("Overlaps between {}:".format(", ".join(wf.get_name() for wf in wavefunctions)), overlaps, ndigit=4)
+        return
 
     print("I have read the following wavefunctions:")
     for wf in wavefunctions:
@@ -30,3 +91,5 @@ def print_matrix(title, matrix, ndigit=2):
 
 if __name__ == "__main__":
     main()
+    statistics = chem_cache.default_cache.get_statistics()
+    logging.info("Eigen cache: %(hits)d hits, %(disk_hits)d disk hits, %(misses)d misses", statistics)
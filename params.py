@@ -1,6 +1,8 @@
 # Dictionnaire des paramètres
 from enum import Enum
 
+import numpy as np
+
 
 class TYPE_ATOME(Enum):
 
@@ -9,12 +11,22 @@ class TYPE_ATOME(Enum):
 
 
 params = {
-    'CARBONEsp2': {'radius': 20, 'color': 'gray',  'symbol': 'C', 'valence': 3, 'border_color': 'black', 'isHuckel': True},
-    'HYDROGENE':  {'radius': 10, 'color': 'white', 'symbol': 'H', 'valence': 1, 'border_color': 'black', 'isHuckel': False},
+    'CARBONEsp2': {'radius': 20, 'color': 'gray',  'symbol': 'C', 'valence': 3, 'border_color': 'black', 'isHuckel': True, 'pi_electrons': 1},
+    'HYDROGENE':  {'radius': 10, 'color': 'white', 'symbol': 'H', 'valence': 1, 'border_color': 'black', 'isHuckel': False, 'pi_electrons': 0},
     'bond_color': 'red',
     'bond_width': 2,
-    'show_symbols': True
+    'show_symbols': True,
+    # Hydrogènes implicites : comptés par atome et affichés dans son label (CH2...) au lieu d'être dessinés ;
+    # désactivé par défaut : chaque carbone sp2 reçoit alors trois atomes d'hydrogène explicites
+    'implicit_hydrogens': False
 }
 
 def isHuckel(type):
-    return params[type]['isHuckel']
\ No newline at end of file
+    return params[type]['isHuckel']
+
+# Tables indexées par les codes de type (int8) du cœur de Molecule
+TYPES = list(TYPE_ATOME)
+TYPE_CODES = {type_atome: code for code, type_atome in enumerate(TYPES)}
+IS_HUCKEL = np.array([params[type_atome.value]['isHuckel'] for type_atome in TYPES], dtype=bool)
+VALENCES = np.array([params[type_atome.value]['valence'] for type_atome in TYPES], dtype=np.int8)
+PI_ELECTRONS = np.array([params[type_atome.value]['pi_electrons'] for type_atome in TYPES], dtype=np.int8)
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from chem_molecule import Molecule
+from chem_resonance import resonance_weights
+from params import TYPE_ATOME
+
+
+@pytest.mark.parametrize('sparse', [False, True])
+def test_duplicate_bond_is_rejected(sparse):
+    molecule = Molecule(sparse=sparse)
+    a = molecule.add_atom(TYPE_ATOME.CARBONE)
+    b = molecule.add_atom(TYPE_ATOME.CARBONE)
+    liaison = molecule.add_bond(a, b)
+    with pytest.raises(ValueError):
+        molecule.add_bond(a, b)
+    with pytest.raises(ValueError):
+        molecule.add_bond(b, a)
+    with pytest.raises(ValueError):
+        molecule.add_bonds([(a.index, b.index), (b.index, a.index)])
+    with pytest.raises(ValueError):
+        molecule.add_bond(a, a)
+    assert molecule.get_bond_between(b, a) is liaison
+    assert len(molecule.liaisons) == 1
+    np.testing.assert_array_equal(molecule._dense_huckel_matrix(), [[0, 1], [1, 0]])
+
+    # the Huckel matrix follows the bond list once the bond is removed
+    molecule.remove_bond(liaison)
+    assert molecule.get_bond_between(a, b) is None
+    np.testing.assert_array_equal(molecule._dense_huckel_matrix(), np.zeros((2, 2)))
+    np.testing.assert_allclose(molecule.wavefunction.get_eigenvalues(), [0, 0])
+
+
+def test_sparse_molecule_of_unbonded_carbons():
+    molecule = Molecule(sparse=True)
+    for _ in range(4):
+        molecule.add_atom(TYPE_ATOME.CARBONE)
+    np.testing.assert_array_equal(molecule.wavefunction.get_eigenvalues(), np.zeros(3))
+
+
+def build_molecule(n_atoms, bonds):
+    molecule = Molecule()
+    molecule.add_atoms([TYPE_ATOME.CARBONE] * n_atoms)
+    molecule.add_bonds(bonds)
+    return molecule
+
+
+BENZENE_BONDS = [(i, (i + 1) % 6) for i in range(6)]
+NAPHTHALENE_BONDS = [(i, (i + 1) % 6) for i in range(6)] + [(4, 6), (6, 7), (7, 8), (8, 9), (9, 5)]
+
+
+@pytest.mark.parametrize('n_atoms, bonds, n_structures', [(6, BENZENE_BONDS, 2), (10, NAPHTHALENE_BONDS, 3)])
+def test_kekule_structures(n_atoms, bonds, n_structures):
+    molecule = build_molecule(n_atoms, bonds)
+    assert molecule.count_kekule_structures() == n_structures
+    matrix = molecule._dense_huckel_matrix()
+    structures = list(molecule.iter_kekule_structures())
+    assert len(structures) == n_structures
+    centres = np.arange(n_atoms)
+    for partners in structures:
+        # every centre is in exactly one double bond, along a bond of the molecule
+        assert np.all(partners != centres)
+        np.testing.assert_array_equal(partners[partners], centres)
+        assert np.all(matrix[centres, partners] != 0)
+    assert len({tuple(partners) for partners in structures}) == n_structures
+
+
+@pytest.mark.parametrize('method', ['cholesky', 'eigen', 'cg'])
+def test_benzene_kekule_weights(method):
+    molecule = build_molecule(6, BENZENE_BONDS)
+    structures = list(molecule.iter_kekule_structures(wavefunctions=True))
+    result = resonance_weights(molecule.wavefunction, structures, method=method)
+    assert result.method == method
+    np.testing.assert_allclose(result.normalized_weights, [0.5, 0.5], atol=1e-8)
+    np.testing.assert_allclose(result.weights[0], result.weights[1], atol=1e-8)
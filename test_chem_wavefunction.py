@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+
+from chem_cache import EigenCache
+from chem_overlap import overlap_matrix
+from chem_store import WavefunctionStore, write_store
+from chem_wavefunction import (Wavefunction, group_equivalent_wavefunctions, read_wavefunctions_from_xml,
+                               write_wavefunctions_to_xml)
+
+
+def ring(n):
+    matrix = np.zeros((n, n))
+    for i in range(n):
+        matrix[i, (i + 1) % n] = matrix[(i + 1) % n, i] = 1.0
+    return matrix
+
+
+def test_bond_toggle_hits_the_eigen_cache():
+    wf = Wavefunction("benzene", ring(6), [2, 2, 2, 0, 0, 0])
+    wf.eigen_cache = EigenCache()
+    wf.get_eigenvalues()
+    for _ in range(3):
+        wf.set_element(0, 3, 1.0)
+        wf.get_eigenvalues()
+        wf.set_element(0, 3, 0.0)
+        wf.get_eigenvalues()
+    # only the first bonded matrix is solved, the five other toggles are cache hits
+    assert wf.eigen_cache.get_statistics()['hits'] == 5
+    np.testing.assert_allclose(wf.get_eigenvalues(), np.sort(np.linalg.eigvalsh(ring(6)))[::-1], atol=1e-12)
+    np.testing.assert_allclose(wf.get_huckel_energy(), 8.0)
+
+
+def test_fractional_occupations_survive_xml_round_trip(tmp_path):
+    # cyclobutadiene cation: the two degenerate non-bonding orbitals share one electron
+    wf = Wavefunction("cyclobutadiene", ring(4), [0, 0, 0, 0])
+    wf.set_electron_count(3)
+    write_wavefunctions_to_xml([wf], str(tmp_path / "open_shell.xml"))
+    read, = read_wavefunctions_from_xml(str(tmp_path / "open_shell.xml"))
+    np.testing.assert_allclose(read.get_occupation(), [2, 0.5, 0.5, 0])
+    assert sum(read.get_occupation()) == 3
+
+
+def test_sparse_zero_matrix_is_solved_without_lanczos():
+    wf = Wavefunction("unbonded", np.zeros((8, 8)), [2, 0, 0, 0, 0, 0, 0, 0], sparse=True)
+    np.testing.assert_array_equal(wf.get_eigenvalues(), np.zeros(2))
+    np.testing.assert_array_equal(wf.get_eigenfunctions().T @ wf.get_eigenfunctions(), np.eye(2))
+    assert wf.get_huckel_energy() == 0.0
+
+
+def test_relabelled_benzenes_are_grouped_without_solving():
+    relabelling = np.array([3, 0, 4, 1, 5, 2])
+    wavefunctions = [Wavefunction("benzene", ring(6), [0] * 6),
+                     Wavefunction("relabelled", ring(6)[np.ix_(relabelling, relabelling)], [0] * 6)]
+    for wf in wavefunctions:
+        wf.eigen_cache = EigenCache()
+        wf.set_electron_count(6)
+    classes = group_equivalent_wavefunctions(wavefunctions)
+    assert len(classes) == 1
+    assert [wf.n_diagonalizations for wf in wavefunctions] == [0, 0]
+    for wf in wavefunctions:
+        np.testing.assert_allclose(wf.get_huckel_energy(), 8.0)
+    # only the representative is diagonalized
+    assert [wf.n_diagonalizations for wf in wavefunctions] == [1, 0]
+
+
+def test_bonds_without_size_are_rejected(tmp_path):
+    path = tmp_path / "ethylene.xml"
+    path.write_text('<wavefunctions><wavefunction name="ethylene"><bonds>0 1</bonds>'
+                    '<occupation>2 0</occupation></wavefunction></wavefunctions>')
+    with pytest.raises(ValueError, match="no size"):
+        read_wavefunctions_from_xml(str(path))
+
+
+def test_store_round_trip_without_diagonalization(tmp_path):
+    allyl = np.array([[0.0, 1.0, 0.0], [1.0, 0.0, 1.0], [0.0, 1.0, 0.0]])
+    wavefunctions = [Wavefunction("benzene", ring(6), [2, 2, 2, 0, 0, 0]), Wavefunction("allyl", allyl, [2, 1, 0])]
+    path = str(tmp_path / "wavefunctions.store")
+    write_store(wavefunctions, path)
+    store = WavefunctionStore(path)
+    assert store.get_names() == ["benzene", "allyl"]
+    for original, read in zip(wavefunctions, store):
+        np.testing.assert_array_equal(read.get_matrix(), original.get_matrix())
+        np.testing.assert_array_equal(read.get_occupation(), original.get_occupation())
+        np.testing.assert_array_equal(read.get_eigenvalues(), original.get_eigenvalues())
+        np.testing.assert_array_equal(read.get_eigenfunctions(), original.get_eigenfunctions())
+        np.testing.assert_allclose(read.get_huckel_energy(), original.get_huckel_energy())
+        assert read.n_diagonalizations == 0
+
+
+def test_overlap_matrix_with_worker_processes():
+    rng = np.random.default_rng(0)
+    wavefunctions = []
+    for k in range(9):
+        matrix = ring(8)
+        matrix[k % 8, k % 8] = rng.normal()
+        wavefunctions.append(Wavefunction("ring{}".format(k), matrix, [2, 2, 2, 2, 0, 0, 0, 0]))
+    serial = overlap_matrix(wavefunctions, tile_size=4)
+    parallel = overlap_matrix(wavefunctions, n_workers=2, processes=True, tile_size=4)
+    np.testing.assert_allclose(parallel, serial, rtol=1e-12, atol=1e-14)
+    np.testing.assert_allclose(np.diag(serial), 1.0)